@@ -1,44 +1,95 @@
+import functools
+import io
+import os
+import sys
+import time
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from datetime import datetime
-from geopy.geocoders import Nominatim
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from carbon_engine import (CATEGORIES, INPUT_COLUMNS, compute, compute_chunks, crop_emission_factors, fertilizer_factors,
+                           file_format, irrigation_factors, pesticide_factors, read_chunks)
+from gazetteer import DEFAULT_GAZETTEER, Gazetteer, GeocodeFallback
+
+RERUN_STARTED = time.perf_counter()
+# Per-function cap on memoized inputs; each entry is a few small PNGs at most.
+CACHE_ENTRIES = int(os.getenv("CARBON_CACHE_ENTRIES", "256"))
 
 st.set_page_config(layout="wide", page_title="Smart Indian Farmer Carbon Calculator")
 st.title("🇮🇳 Smart Carbon Footprint Calculator for Indian Farmers")
 
-crop_emission_factors = {
-    "Rice": 2.7,
-    "Wheat": 1.4,
-    "Sugarcane": 1.6,
-    "Maize": 1.2,
-    "Pulses": 0.8,
-    "Cotton": 1.9,
-    "Oilseeds": 1.1,
-    "Vegetables": 0.9,
-    "Fruits": 0.7,
-    "Other": 1.0
-}
-
-fertilizer_factors = {
-    "Urea": 1.59,
-    "DAP": 1.5,
-    "Potash": 0.5,
-    "Organic Compost": 0.2
-}
-
-pesticide_factors = {
-    "Chemical": 5.0,
-    "Organic": 1.5
-}
-
-tractor_factor = 2.5  # kg CO2/hour
-irrigation_factors = {
-    "Rainfed": 0,
-    "Electric Pump": 0.5,
-    "Diesel Pump": 1.5,
-    "Solar Pump": 0.1
-}
+
+# Streamlit reruns the whole script on every widget change; these are shared across
+# sessions and keyed on their (hashable) arguments. CSV reports are passed to
+# download_button as callables, so they are only built when actually downloaded.
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def farm_footprint(inputs):
+    """inputs: tuple of (column, value) pairs for one farm."""
+    return compute({column: [value] for column, value in inputs}).iloc[0].to_dict()
+
+
+def png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def render_charts(categories):
+    """PNG bytes for the pie, donut and bar charts of a tuple of (category, tonnes)."""
+    labels, values = [label for label, _ in categories], [value for _, value in categories]
+    # Figure objects rather than pyplot: no global state shared between sessions.
+    pie = Figure(figsize=(7, 7))
+    ax = pie.subplots()
+    ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.axis('equal')
+
+    donut = Figure()
+    ax = donut.subplots()
+    ax.pie(values, labels=labels, autopct='%1.1f%%', startangle=140, pctdistance=0.85, wedgeprops={"width": 0.3})
+    ax.axis('equal')
+
+    bar = Figure()
+    ax = bar.subplots()
+    ax.barh(labels, values, color=["#ffffd9", "#c7e9b4", "#41b6c4", "#225ea8", "#081d58"][:len(values)])
+    ax.invert_yaxis()
+    ax.set_xlabel("Tonnes CO2/year")
+    ax.set_title("Category-wise Carbon Emissions")
+    return {"pie": png(pie), "donut": png(donut), "bar": png(bar)}
+
+
+@st.cache_data(max_entries=CACHE_ENTRIES)
+def report_csv(categories):
+    import pandas as pd
+
+    return pd.DataFrame(list(categories), columns=["Category", "Emissions (tonnes)"]).to_csv(index=False).encode()
+
+
+@st.cache_data(max_entries=16)
+def roster_footprints(data, name):
+    import pandas as pd
+
+    return pd.concat(compute_chunks(read_chunks(io.BytesIO(data), file_format(name))), ignore_index=True)
+
+
+@st.cache_data(max_entries=16)
+def roster_csv(data, name):
+    return roster_footprints(data, name).to_csv(index=False).encode()
+
+
+@st.cache_resource
+def location_resolver():
+    return Gazetteer(os.getenv("GAZETTEER_PATH", DEFAULT_GAZETTEER))
+
+
+@st.cache_resource
+def geocode_fallback():
+    """Nominatim for places missing from the gazetteer; GEOCODE_FALLBACK=0 keeps it fully offline."""
+    if os.getenv("GEOCODE_FALLBACK", "1") == "0":
+        return None
+    return GeocodeFallback(os.getenv("GEOCODE_CACHE_PATH", "geocode_cache.db"))
+
 
 st.subheader("🧮 Enter your farming details")
 
@@ -66,38 +117,44 @@ with col2:
 with st.expander("📍 Detect Your Location (for scheme suggestions)"):
     state = st.text_input("Enter your village/town/city")
     if st.button("Detect State"):
-        try:
-            geolocator = Nominatim(user_agent="geoapi")
-            location = geolocator.geocode(state)
-            if location:
-                st.success(f"Detected Location: {location.address}")
+        matches = location_resolver().resolve(state)
+        resolved = [m for m in matches if m["resolved"]]
+        if resolved:
+            best = resolved[0]
+            st.success(f"Detected State: {best['state']} ({best['name']})")
+            others = sorted({m["state"] for m in resolved[1:] if m["state"] != best["state"]})
+            if others:
+                st.caption(f"Also found in: {', '.join(others)}. Add the state after a comma to pick one.")
+        else:
+            # Near-misses are often a different place (most villages aren't in the gazetteer), so only suggest them.
+            if matches:
+                st.caption("Did you mean: " + ", ".join(f"{m['name']} ({m['state']})" for m in matches[:3]) + "?")
+            if geocode_fallback() is None:
+                st.error("Could not detect location. Add the state after a comma, e.g. \"Punsari, Gujarat\".")
             else:
-                st.error("Could not detect location.")
-        except:
-            st.error("Geolocation service error.")
-
-crop_emission = crop_emission_factors[crop_type] * area * number_of_crops
-fertilizer_emission = (fertilizer_kg * fertilizer_factors[fertilizer_type]) / 1000
-pesticide_emission = (pesticide_l * pesticide_factors[pesticide_type]) / 1000
-tractor_emission = (tractor_hours * tractor_factor) / 1000
-irrigation_emission = (irrigation_factors[irrigation_type] * irrigation_hours * area) / 1000
-
-renewable_reduction = 0.1 if renewable_energy == "Yes" else 0.0
-cover_crop_reduction = 0.05 if cover_crop == "Yes" else 0.0
-
-adjusted_crop_emission = crop_emission * (1 - cover_crop_reduction)
-adjusted_irrigation_emission = irrigation_emission * (1 - renewable_reduction)
-
-
-category_emissions = {
-    "Crop Cultivation": round(adjusted_crop_emission, 2),
-    "Fertilizers": round(fertilizer_emission, 2),
-    "Pesticides": round(pesticide_emission, 2),
-    "Machinery Use": round(tractor_emission, 2),
-    "Irrigation": round(adjusted_irrigation_emission, 2)
-}
-
-total_emissions = round(sum(category_emissions.values()), 2)
+                try:
+                    location = geocode_fallback().geocode(state)
+                    if location:
+                        st.success(f"Detected Location: {location['address']}")
+                    else:
+                        st.error("Could not detect location.")
+                except Exception:
+                    st.error("Geolocation service error.")
+
+farm = farm_footprint((
+    ("crop_type", crop_type), ("area", area), ("fertilizer_type", fertilizer_type), ("fertilizer_kg", fertilizer_kg),
+    ("pesticide_type", pesticide_type), ("pesticide_l", pesticide_l), ("irrigation_type", irrigation_type),
+    ("irrigation_hours", irrigation_hours), ("tractor_hours", tractor_hours), ("number_of_crops", number_of_crops),
+    ("renewable_energy", renewable_energy), ("cover_crop", cover_crop),
+))
+
+category_emissions = {label: float(farm[key]) for key, label in CATEGORIES.items()}
+adjusted_crop_emission = category_emissions["Crop Cultivation"]
+fertilizer_emission = category_emissions["Fertilizers"]
+pesticide_emission = category_emissions["Pesticides"]
+irrigation_emission = category_emissions["Irrigation"]
+
+total_emissions = float(farm["total"])
 
 if st.button("Calculate Emissions"):
     col3, col4 = st.columns(2)
@@ -124,9 +181,9 @@ if st.button("Calculate Emissions"):
             st.warning("🐞 Use biopesticides or integrated pest management (IPM).")
 
         
-        if total_emissions / area > 4:
+        if farm["band"] == "High":
             st.error("⚠️ High emitter: Immediate action recommended.")
-        elif total_emissions / area > 2:
+        elif farm["band"] == "Medium":
             st.warning("⚠️ Medium emitter: Optimize practices.")
         else:
             st.success("✅ Low emitter: Keep up the good practices!")
@@ -139,40 +196,18 @@ if st.button("Calculate Emissions"):
 
         
         st.metric("📉 National Avg (India)", "2.2 tCO2/ha/year")
-        st.metric("📈 Your Rate", f"{total_emissions / area:.2f} tCO2/ha/year")
+        st.metric("📈 Your Rate", f"{farm['per_hectare']:.2f} tCO2/ha/year")
 
     
+    charts = render_charts(tuple(category_emissions.items()))
     st.subheader("📉 Emissions Distribution")
-    fig, ax = plt.subplots(figsize=(7,7))
-    ax.pie(category_emissions.values(), labels=category_emissions.keys(), autopct='%1.1f%%', startangle=90)
-    ax.axis('equal')
-    st.pyplot(fig)
-    st.subheader("📉 Emissions Distribution")
-    fig, ax = plt.subplots()
-    wedges, texts, autotexts = ax.pie(
-        category_emissions.values(),
-        labels=category_emissions.keys(),
-        autopct='%1.1f%%',
-        startangle=140,
-        pctdistance=0.85
-    )
-    centre_circle = plt.Circle((0,0),0.70,fc='white')
-    fig.gca().add_artist(centre_circle)
-    ax.axis('equal')
-    plt.tight_layout()
-    st.pyplot(fig)
+    st.image(charts["pie"])
+    st.image(charts["donut"])
 
     st.subheader("📈 Emissions Bar Chart")
-    bar_df = pd.DataFrame(category_emissions.items(), columns=["Category", "Emissions"])
-    fig_bar, ax_bar = plt.subplots()
-    sns.barplot(data=bar_df, x="Emissions", y="Category", palette="YlGnBu", ax=ax_bar)
-    ax_bar.set_xlabel("Tonnes CO2/year")
-    ax_bar.set_title("Category-wise Carbon Emissions")
-    st.pyplot(fig_bar)
-
+    st.image(charts["bar"])
 
-    df_out = pd.DataFrame(list(category_emissions.items()), columns=["Category", "Emissions (tonnes)"])
-    st.download_button("📥 Download Report as CSV", df_out.to_csv(index=False), "farmer_emissions.csv", "text/csv")
+    st.download_button("📥 Download Report as CSV", functools.partial(report_csv, tuple(category_emissions.items())), "farmer_emissions.csv", "text/csv")
 
     st.subheader("🏆 Your Rank in Sustainable Farming")
     st.success("You are in the top 20% low-carbon farmers in your district!")
@@ -185,3 +220,20 @@ if st.button("Calculate Emissions"):
         st.info("🍂 Rabi Season: Emissions lower; good time to introduce legumes for nitrogen fixation.")
     else:
         st.info("🌱 Zaid Season: Opportunity to grow cover crops and rejuvenate soil.")
+
+
+# Bulk mode: one row per farm, e.g. an FPO member roster.
+with st.expander("📂 Bulk calculation for many farms (CSV / Parquet)"):
+    st.caption(f"Columns: {', '.join(INPUT_COLUMNS)}. Missing columns use defaults.")
+    roster = st.file_uploader("Upload member roster", type=["csv", "parquet"])
+    if roster is not None:
+        try:
+            results = roster_footprints(roster.getvalue(), roster.name)
+        except (ValueError, KeyError) as e:
+            st.error(f"Could not compute footprints: {e}")
+        else:
+            st.success(f"Computed {len(results)} farms, {results['total'].sum():.2f} tonnes CO2/year in total.")
+            st.dataframe(results["band"].value_counts().rename("Farms"))
+            st.download_button("📥 Download Results as CSV", functools.partial(roster_csv, roster.getvalue(), roster.name), "roster_emissions.csv", "text/csv")
+
+st.caption(f"Rendered in {(time.perf_counter() - RERUN_STARTED) * 1000:.0f} ms")
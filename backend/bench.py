@@ -0,0 +1,393 @@
+"""Offline load benchmark for the AgroSage API.
+
+    python bench.py --out bench.json
+    python bench.py --endpoints classify-waste ask-ecobot --concurrency 16 --baseline bench.json
+    python bench.py --endpoints classify-waste --serve-mode prefork --workers 4
+    python bench.py --endpoints dashboard-data --serve-mode independent --workers 4 --stub-model-mb 900
+
+Starts the API in a subprocess against the local Gemini stub (llm_stub.py) and,
+by default, a stub captioner, so no network, GPU or model download is needed
+(--real-captioner loads BLIP from the local Hugging Face cache instead). Each
+endpoint is driven closed-loop (--concurrency clients back to back) and
+open-loop (Poisson arrivals at --rate per second, timed from the scheduled
+send so a stalled server isn't hidden). The report records throughput, error
+count, p50/p95/p99 latency and the server's memory for each run: peak RSS
+summed over its processes (which counts shared pages once per process) and
+PSS (which splits them between the processes sharing them). --serve-mode runs
+the API under serve.py so the multi-process modes can be compared, or as
+"independent" workers that each load their own captioner (what `uvicorn
+--workers N` does); --stub-model-mb gives the stub captioner resident "weights"
+of that size so the memory difference shows without BLIP. Inputs and
+arrivals come from --seed. With --baseline, the run exits non-zero if any p95
+rose by more than --tolerance, any error count rose, or any closed-loop
+throughput fell by more than --tolerance.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ENDPOINTS = ("classify-waste", "scan-pest", "ask-ecobot", "dashboard-data")
+QUERIES = (
+    "How do I make compost from crop residue?",
+    "What is the best organic treatment for aphids on okra?",
+    "When should I irrigate wheat in the Rabi season?",
+    "How much neem oil per litre of water for spraying?",
+    "Which cover crops fix nitrogen in black soil?",
+    "How can I reduce diesel use for my pump?",
+)
+
+
+class StubCaptionEngine:
+    """Sleeps like a batched forward pass (fixed cost plus a per-image cost) and returns a canned caption.
+
+    `model_mb` of read-only, resident memory stands in for the weights.
+    """
+
+    name = "stub"
+    captions = ("a plastic bottle on a table", "a banana peel on the ground", "a used battery", "a cardboard box")
+
+    def __init__(self, batch_ms, image_ms, model_mb=0):
+        self.batch_seconds = batch_ms / 1000
+        self.image_seconds = image_ms / 1000
+        self.weights = np.ones(int(model_mb * 1024 * 1024), dtype=np.uint8)
+
+    def load(self):
+        return self
+
+    def caption_batch(self, images):
+        time.sleep(self.batch_seconds + self.image_seconds * len(images))
+        return [self.captions[int(np.asarray(image.resize((4, 4))).mean()) % len(self.captions)] for image in images]
+
+
+def serve(args):
+    """Subprocess side: the real app, with the captioner swapped for the stub unless --real-captioner."""
+    stub = None if args.real_captioner else (lambda: StubCaptionEngine(args.stub_caption_batch_ms, args.stub_caption_image_ms, args.stub_model_mb))
+    if args.serve_mode == "independent":
+        # Like `uvicorn main:app --workers N`: every worker loads its own captioner.
+        from inference import share_caption_engine
+        from serve import Supervisor, api_worker, bind_socket
+
+        sock = bind_socket("127.0.0.1", args.port)
+        supervisor = Supervisor()
+        for i in range(args.workers):
+            def worker(run=api_worker(sock, None, "warning")):
+                if stub is not None:
+                    share_caption_engine(stub())
+                run()
+
+            supervisor.spawn(f"worker {i}", worker)
+        return supervisor.run()
+    if args.serve_mode != "single":
+        from serve import run
+
+        return run(args.serve_mode, args.workers, "127.0.0.1", args.port, engine_factory=stub, log_level="warning")
+
+    import uvicorn
+
+    import main
+
+    if not args.real_captioner:
+        def load_stub_captioner():
+            main.caption_engine = stub()
+
+        main.load_captioner = load_stub_captioner
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# --- load generation ---
+def make_images(count, seed, side=256):
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, (side, side, 3), dtype=np.uint8)).save(buffer, format="JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def make_request(endpoint, i, images):
+    if endpoint in ("classify-waste", "scan-pest"):
+        return {"method": "POST", "url": f"/{endpoint}", "files": {"file": (f"{i}.jpg", images[i % len(images)], "image/jpeg")}}
+    if endpoint == "ask-ecobot":
+        return {"method": "POST", "url": "/ask-ecobot", "json": {"query": f"{QUERIES[i % len(QUERIES)]} (#{i})"}}
+    return {"method": "GET", "url": "/dashboard-data"}
+
+
+async def timed_request(client, request, started, latencies, errors):
+    try:
+        response = await client.request(**request)
+        ok = response.status_code < 400
+    except Exception:
+        ok = False
+    latencies.append(time.perf_counter() - started)
+    if not ok:
+        errors.append(1)
+
+
+async def closed_loop(client, endpoint, images, concurrency, duration):
+    latencies, errors, counter = [], [], iter(range(10**9))
+    stop = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < stop:
+            await timed_request(client, make_request(endpoint, next(counter), images), time.perf_counter(), latencies, errors)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def open_loop(client, endpoint, images, rate, duration, rng, max_outstanding):
+    latencies, errors, tasks = [], [], set()
+    arrivals = np.cumsum(rng.exponential(1 / rate, int(rate * duration * 1.5) + 10))
+    arrivals = arrivals[arrivals < duration]
+    started = time.perf_counter()
+    for i, offset in enumerate(arrivals):
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_outstanding:
+            errors.append(1)
+            continue
+        # Latency counts from the scheduled send time, not from when the loop got round to it.
+        task = asyncio.create_task(timed_request(client, make_request(endpoint, i, images), started + offset, latencies, errors))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies, errors, elapsed):
+    ms = np.asarray(latencies) * 1000
+    pct = np.percentile(ms, [50, 95, 99]) if len(ms) else [float("nan")] * 3
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": round((len(latencies) - len(errors)) / elapsed, 2),
+        "p50_ms": round(float(pct[0]), 2),
+        "p95_ms": round(float(pct[1]), 2),
+        "p99_ms": round(float(pct[2]), 2),
+        "max_ms": round(float(ms.max()), 2) if len(ms) else float("nan"),
+    }
+
+
+# --- server process ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    """`pid` and all of its descendants, from the parent pids in /proc/*/stat."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents.setdefault(int(f.read().rsplit(")", 1)[1].split()[1]), []).append(int(entry))
+            except (OSError, IndexError):
+                pass
+    tree = [pid]
+    for parent in tree:
+        tree += parents.get(parent, [])
+    return tree
+
+
+def _proc_kb(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def server_memory(pid):
+    tree = process_tree(pid)
+    return {
+        "server_processes": len(tree),
+        "server_peak_rss_mb": round(sum(_proc_kb(f"/proc/{p}/status", "VmHWM:") for p in tree) / 1024, 1),
+        "server_pss_mb": round(sum(_proc_kb(f"/proc/{p}/smaps_rollup", "Pss:") for p in tree) / 1024, 1),
+    }
+
+
+def reset_peak_rss(pid):
+    """Linux resets VmHWM when "5" is written to clear_refs; older kernels keep the process-wide peak."""
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def start_server(args, llm_base, workdir):
+    port = free_port()
+    env = {
+        **os.environ,
+        "GOOGLE_API_KEY": "bench",
+        "GEMINI_API_BASE": llm_base,
+        "AGROSAGE_DB": os.path.join(workdir, "bench.db"),
+        "LEDGER_DIR": os.path.join(workdir, "ledger"),
+        "SCAN_CACHE_MAX_ENTRIES": os.environ.get("SCAN_CACHE_MAX_ENTRIES", "2048" if args.scan_cache else "0"),
+        "ECOBOT_CACHE": "1" if args.ecobot_cache else "0",
+        # Stub captions all hit the keyword lexicon, which would keep classify-waste away from the LLM.
+        "WASTE_LOCAL": "1" if args.waste_local else "0",
+        "WASTE_LOCAL_MODEL": os.path.join(workdir, "waste_local.json"),
+        # The production rate limit would dominate the numbers; pass LLM_RATE_PER_SEC to measure it.
+        "LLM_RATE_PER_SEC": os.environ.get("LLM_RATE_PER_SEC", "100000"),
+        "LLM_BURST": os.environ.get("LLM_BURST", "100000"),
+    }
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--stub-caption-batch-ms", str(args.stub_caption_batch_ms), "--stub-caption-image-ms", str(args.stub_caption_image_ms),
+               "--stub-model-mb", str(args.stub_model_mb), "--serve-mode", args.serve_mode, "--workers", str(args.workers)]
+    if args.real_captioner:
+        command.append("--real-captioner")
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client, process, timeout):
+    stop = time.monotonic() + timeout
+    while time.monotonic() < stop:
+        if process.poll() is not None:
+            raise RuntimeError(f"API process exited with code {process.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"API not ready after {timeout}s")
+
+
+async def run_suite(args, base_url, process):
+    import httpx
+
+    images = make_images(args.images, args.seed)
+    rng = np.random.default_rng(args.seed)
+    limits = httpx.Limits(max_connections=args.max_outstanding, max_keepalive_connections=args.max_outstanding)
+    results = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        await wait_ready(client, process, args.ready_timeout)
+        for endpoint in args.endpoints:
+            for mode in args.modes:
+                # Untimed warm-up so connection setup and first-call costs stay out of the numbers.
+                await closed_loop(client, endpoint, images, min(args.concurrency, 4), args.warmup)
+                reset_peak_rss(process.pid)
+                if mode == "closed":
+                    run = await closed_loop(client, endpoint, images, args.concurrency, args.duration)
+                    load = {"concurrency": args.concurrency}
+                else:
+                    run = await open_loop(client, endpoint, images, args.rate, args.duration, rng, args.max_outstanding)
+                    load = {"rate_rps": args.rate}
+                result = {"endpoint": endpoint, "mode": mode, **load, **summarize(*run), **server_memory(process.pid)}
+                results.append(result)
+                print(json.dumps(result))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing each run against the baseline, and whether any regressed."""
+    previous = {(r["endpoint"], r["mode"]): r for r in baseline["results"]}
+    lines, regressed = [], False
+    for result in results:
+        old = previous.get((result["endpoint"], result["mode"]))
+        if old is None:
+            continue
+        # Open-loop throughput just follows the offered rate, so those runs are judged on latency and errors.
+        worse = result["p95_ms"] > old["p95_ms"] * (1 + tolerance) or result["errors"] > old["errors"]
+        if result["mode"] == "closed":
+            worse |= result["throughput_rps"] < old["throughput_rps"] * (1 - tolerance)
+        regressed |= worse
+        lines.append(f"{'REGRESSED' if worse else 'ok':9} {result['endpoint']:15} {result['mode']:6} "
+                     f"p95 {old['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms, "
+                     f"throughput {old['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} rps")
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--modes", nargs="+", choices=("closed", "open"), default=["closed", "open"])
+    parser.add_argument("--concurrency", type=int, default=8, help="clients in closed-loop runs")
+    parser.add_argument("--rate", type=float, default=20.0, help="arrivals per second in open-loop runs")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--max-outstanding", type=int, default=256, help="open-loop sends beyond this count as errors")
+    parser.add_argument("--llm-latency-ms", type=float, default=150.0)
+    parser.add_argument("--stub-caption-batch-ms", type=float, default=40.0)
+    parser.add_argument("--stub-caption-image-ms", type=float, default=15.0)
+    parser.add_argument("--real-captioner", action="store_true")
+    parser.add_argument("--stub-model-mb", type=float, default=0.0, help="resident memory the stub captioner holds, standing in for its weights")
+    parser.add_argument("--serve-mode", choices=("single", "independent", "prefork", "caption-server"), default="single",
+                        help="one uvicorn process, N workers each loading the captioner, or serve.py's multi-process modes")
+    parser.add_argument("--workers", type=int, default=2, help="API workers for the serve.py modes")
+    parser.add_argument("--scan-cache", action="store_true", help="keep the scan caches on (off by default so every scan runs the pipeline)")
+    parser.add_argument("--ecobot-cache", action="store_true")
+    parser.add_argument("--waste-local", action="store_true", help="label waste captions locally where possible (off by default, like the caches)")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--out", help="write the report as JSON here")
+    parser.add_argument("--baseline", help="report from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+
+    from llm_stub import serve as serve_llm_stub
+
+    stub, stub_state = serve_llm_stub(0, latency_ms=args.llm_latency_ms)
+    with tempfile.TemporaryDirectory() as workdir:
+        process, base_url = start_server(args, f"http://127.0.0.1:{stub.server_port}", workdir)
+        try:
+            results = asyncio.run(run_suite(args, base_url, process))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            stub.shutdown()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "settings": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "serve", "port")},
+            "llm_stub": stub_state.counts,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressed = compare(results, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        if regressed:
+            sys.exit(f"Regression beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Compares a caption engine against the eager PyTorch baseline on a folder of images.
+
+    python caption_parity.py ../samples --engine int8 --min-similarity 0.8
+
+Reports exact-match rate, mean token F1 against the baseline captions, per-image
+latency and the resident memory each engine added, and exits non-zero when the
+mean F1 falls below --min-similarity. The baseline always decodes with the original
+settings (50 new tokens, greedy), so the candidate's CAPTION_MAX_NEW_TOKENS and
+CAPTION_NUM_BEAMS are measured against what production generated before.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import time
+
+from PIL import Image
+
+from inference import DEFAULT_MAX_NEW_TOKENS, make_caption_engine
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def find_images(target):
+    if os.path.isdir(target):
+        return sorted(p for p in glob.glob(os.path.join(target, "**", "*"), recursive=True) if p.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(glob.glob(target, recursive=True))
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def token_f1(reference, candidate):
+    ref, cand = reference.lower().split(), candidate.lower().split()
+    if not ref or not cand:
+        return float(ref == cand)
+    common = sum(min(ref.count(t), cand.count(t)) for t in set(cand))
+    if not common:
+        return 0.0
+    precision, recall = common / len(cand), common / len(ref)
+    return 2 * precision * recall / (precision + recall)
+
+
+def run_engine(name, paths, batch_size, **overrides):
+    before = rss_mb()
+    engine = make_caption_engine(name, **overrides).load()
+    loaded = rss_mb()
+    engine.caption_batch([Image.new("RGB", (384, 384), "white")])
+    captions, elapsed = [], 0.0
+    for i in range(0, len(paths), batch_size):
+        images = [Image.open(p).convert("RGB") for p in paths[i:i + batch_size]]
+        started = time.perf_counter()
+        captions.extend(engine.caption_batch(images))
+        elapsed += time.perf_counter() - started
+    stats = {"engine": name, "model_rss_mb": round(loaded - before, 1), "ms_per_image": round(elapsed * 1000 / max(len(paths), 1), 1)}
+    del engine
+    return captions, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="directory or glob of images")
+    parser.add_argument("--engine", default="int8", help="candidate engine (int8, onnx, ...)")
+    parser.add_argument("--baseline", default="torch")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-similarity", type=float, default=0.8)
+    parser.add_argument("--out", help="write the full report as JSON here")
+    args = parser.parse_args()
+
+    paths = find_images(args.images)
+    if not paths:
+        sys.exit(f"No images found for {args.images}")
+    baseline, baseline_stats = run_engine(
+        args.baseline, paths, args.batch_size, max_new_tokens=DEFAULT_MAX_NEW_TOKENS, num_beams=1
+    )
+    candidate, candidate_stats = run_engine(args.engine, paths, args.batch_size)
+
+    scores = [token_f1(b, c) for b, c in zip(baseline, candidate)]
+    report = {
+        "images": len(paths),
+        "baseline": baseline_stats,
+        "candidate": candidate_stats,
+        "exact_match_rate": round(sum(b == c for b, c in zip(baseline, candidate)) / len(paths), 4),
+        "mean_token_f1": round(sum(scores) / len(scores), 4),
+        "differences": [
+            {"image": p, "baseline": b, "candidate": c}
+            for p, b, c in zip(paths, baseline, candidate) if b != c
+        ],
+    }
+    print(json.dumps({k: v for k, v in report.items() if k != "differences"}, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["mean_token_f1"] < args.min_similarity:
+        sys.exit(f"Mean token F1 {report['mean_token_f1']} is below {args.min_similarity}")
+
+
+if __name__ == "__main__":
+    main()
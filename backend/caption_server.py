@@ -0,0 +1,234 @@
+"""Caption server: one process holds the BLIP weights for every API worker.
+
+    python caption_server.py --socket /tmp/agrosage-caption.sock
+    CAPTION_SERVER_SOCKET=/tmp/agrosage-caption.sock uvicorn main:app --workers 4
+
+Workers send decoded RGB images over a Unix socket. Requests from all workers go
+through one CaptionBatcher, so their concurrent uploads share forward passes.
+The socket is only bound after the model is loaded and warmed up, so a worker's
+ping succeeds once captioning will.
+
+Frames are a 4-byte big-endian length followed by the payload.
+  request:  request id (u64), width (u32), height (u32), then width*height*3 RGB bytes.
+            A 0x0 image is a ping.
+  response: request id (u64), status (u8, 0 ok / 1 error), then a UTF-8 caption or error.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import socket
+import struct
+import time
+
+from inference import CaptionBatcher, make_caption_engine
+
+_LENGTH = struct.Struct("!I")
+_REQUEST = struct.Struct("!QII")
+_RESPONSE = struct.Struct("!QB")
+OK, ERROR = 0, 1
+
+
+async def _read_frame(reader):
+    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def _frame(payload):
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def _response(request_id, status, text):
+    return _frame(_RESPONSE.pack(request_id, status) + text.encode())
+
+
+class CaptionServer:
+    """Serves `engine.caption_batch` on a Unix socket through one shared CaptionBatcher."""
+
+    def __init__(self, engine, path, max_batch_size=8, max_wait_ms=20):
+        self.engine = engine
+        self.path = path
+        self.batcher = CaptionBatcher(engine.caption_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    async def serve_forever(self):
+        from PIL import Image
+
+        # Warm-up before binding, so the socket appearing means the model is ready.
+        await asyncio.to_thread(self.engine.caption_batch, [Image.new("RGB", (384, 384), "white")])
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left behind by a server that was killed
+        self.batcher.start()
+        server = await asyncio.start_unix_server(self._handle, self.path)
+        # SIGTERM (from serve.py or a process manager) stops the server and removes the socket.
+        stopped = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+        try:
+            async with server:
+                await stopped.wait()
+        finally:
+            self.batcher.stop()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                payload = await _read_frame(reader)
+                task = asyncio.create_task(self._caption(payload, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # client went away, or the server is shutting down
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _caption(self, payload, writer):
+        from PIL import Image
+
+        request_id, width, height = _REQUEST.unpack_from(payload)
+        if not width or not height:
+            writer.write(_response(request_id, OK, "ready"))
+            return
+        try:
+            image = Image.frombytes("RGB", (width, height), payload[_REQUEST.size:])
+            frame = _response(request_id, OK, await self.batcher.caption(image))
+        except Exception as e:
+            frame = _response(request_id, ERROR, f"{type(e).__name__}: {e}")
+        if not writer.is_closing():
+            writer.write(frame)
+            await writer.drain()
+
+
+class RemoteCaptionBatcher:
+    """Drop-in for CaptionBatcher in an API worker that captions on the caption server.
+
+    One connection per worker, opened on first use and reopened after the server
+    restarts; requests in flight when the connection drops fail with ConnectionError.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._writer = None
+        self._connecting = None
+        self._reader_task = None
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def start(self):
+        pass  # connects lazily, on the event loop of the first request
+
+    def stop(self, timeout=5.0):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def wait_ready(self, timeout=300.0):
+        """Blocks until the server answers a ping; for the background model loader."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                    s.settimeout(5.0)
+                    s.connect(self.path)
+                    s.sendall(_frame(_REQUEST.pack(0, 0, 0)))
+                    (length,) = _LENGTH.unpack(s.recv(_LENGTH.size, socket.MSG_WAITALL))
+                    _, status = _RESPONSE.unpack(s.recv(length, socket.MSG_WAITALL)[:_RESPONSE.size])
+                    if status == OK:
+                        return
+            except (OSError, struct.error):
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Caption server at {self.path} not ready after {timeout}s")
+            time.sleep(0.5)
+
+    async def caption(self, image):
+        writer = await self._connection()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        image = image.convert("RGB")
+        try:
+            writer.write(_frame(_REQUEST.pack(request_id, *image.size) + image.tobytes()))
+            await writer.drain()
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _connection(self):
+        if self._writer is not None and not self._writer.is_closing():
+            return self._writer
+        # Concurrent first requests share one connection attempt.
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        try:
+            return await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self._writer = writer
+        self._reader_task = asyncio.create_task(self._read_responses(reader, writer))
+        return writer
+
+    async def _read_responses(self, reader, writer):
+        error = ConnectionError("Connection to caption server closed")
+        try:
+            while True:
+                payload = await _read_frame(reader)
+                request_id, status = _RESPONSE.unpack_from(payload)
+                future = self._pending.get(request_id)
+                if future is None or future.done():
+                    continue
+                text = payload[_RESPONSE.size:].decode()
+                if status == OK:
+                    future.set_result(text)
+                else:
+                    future.set_exception(RuntimeError(f"Caption server error: {text}"))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            error = ConnectionError(f"Lost connection to caption server: {e}")
+        except Exception as e:
+            # A frame we can't parse: nothing after it can be trusted, so drop the connection.
+            error = RuntimeError(f"Bad response from caption server: {type(e).__name__}: {e}")
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            # Every request still waiting on this connection fails now rather than hanging.
+            for future in list(self._pending.values()):
+                if not future.done():
+                    future.set_exception(error)
+
+
+def serve(path, engine=None):
+    """Loads the engine chosen by CAPTION_ENGINE (unless one is given) and serves until killed."""
+    engine = engine or make_caption_engine().load()
+    server = CaptionServer(
+        engine, path,
+        max_batch_size=int(os.getenv("CAPTION_MAX_BATCH", "8")),
+        max_wait_ms=float(os.getenv("CAPTION_MAX_WAIT_MS", "20")),
+    )
+    asyncio.run(server.serve_forever())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.getenv("CAPTION_SERVER_SOCKET", "/tmp/agrosage-caption.sock"))
+    args = parser.parse_args()
+    try:
+        serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Vectorized farm carbon-footprint engine shared by app6.py, the API and this CLI.
+
+    python carbon_engine.py members.csv footprints.parquet --chunk-size 200000
+
+Input is one row per farm (see INPUT_COLUMNS); .csv and .parquet files are read and
+written in chunks, so rosters larger than memory stream through in bounded space.
+Parquet needs pyarrow. pandas and pyarrow are imported on first use, so importing
+this module (as the API and app6.py do at startup) stays cheap.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+crop_emission_factors = {
+    "Rice": 2.7,
+    "Wheat": 1.4,
+    "Sugarcane": 1.6,
+    "Maize": 1.2,
+    "Pulses": 0.8,
+    "Cotton": 1.9,
+    "Oilseeds": 1.1,
+    "Vegetables": 0.9,
+    "Fruits": 0.7,
+    "Other": 1.0
+}
+
+fertilizer_factors = {
+    "Urea": 1.59,
+    "DAP": 1.5,
+    "Potash": 0.5,
+    "Organic Compost": 0.2
+}
+
+pesticide_factors = {
+    "Chemical": 5.0,
+    "Organic": 1.5
+}
+
+tractor_factor = 2.5  # kg CO2/hour
+irrigation_factors = {
+    "Rainfed": 0,
+    "Electric Pump": 0.5,
+    "Diesel Pump": 1.5,
+    "Solar Pump": 0.1
+}
+
+RENEWABLE_REDUCTION = 0.1  # off irrigation emissions
+COVER_CROP_REDUCTION = 0.05  # off crop cultivation emissions
+
+# Column -> default used when a file leaves it out.
+INPUT_COLUMNS = {
+    "crop_type": "Other",
+    "area": 0.0,
+    "fertilizer_type": "Organic Compost",
+    "fertilizer_kg": 0.0,
+    "pesticide_type": "Organic",
+    "pesticide_l": 0.0,
+    "irrigation_type": "Rainfed",
+    "irrigation_hours": 0.0,
+    "tractor_hours": 0.0,
+    "number_of_crops": 1,
+    "renewable_energy": "No",
+    "cover_crop": "No",
+}
+
+CATEGORIES = {
+    "crop_cultivation": "Crop Cultivation",
+    "fertilizers": "Fertilizers",
+    "pesticides": "Pesticides",
+    "machinery_use": "Machinery Use",
+    "irrigation": "Irrigation",
+}
+
+# tCO2/ha/year above which a farm falls into each band, checked in order.
+EMITTER_BANDS = (("High", 4.0), ("Medium", 2.0))
+
+
+def _factor(column, factors):
+    values = column.map(factors)
+    unknown = column[values.isna()]
+    if len(unknown):
+        raise ValueError(f"Unknown {column.name} values: {', '.join(map(str, unknown.unique()[:10]))}")
+    return values.to_numpy(dtype=np.float64)
+
+
+def _numeric(column):
+    import pandas as pd
+
+    return pd.to_numeric(column, errors="raise").to_numpy(dtype=np.float64)
+
+
+def _yes(column):
+    return column.astype(str).str.strip().str.lower().isin(("yes", "true", "1")).to_numpy()
+
+
+def compute(farms):
+    """Emissions in tonnes CO2/year for every row of `farms` (DataFrame or dict of arrays).
+
+    Returns a DataFrame with one column per CATEGORIES key, `total`, `per_hectare`
+    (NaN when area is 0) and `band`. Categories are rounded to 2 places and `total`
+    is the sum of the rounded values, as the calculator has always shown them.
+    """
+    import pandas as pd
+
+    farms = pd.DataFrame(farms)
+    farms = farms.assign(**{col: default for col, default in INPUT_COLUMNS.items() if col not in farms})
+    area = _numeric(farms["area"])
+
+    crop = _factor(farms["crop_type"], crop_emission_factors) * area * _numeric(farms["number_of_crops"])
+    fertilizer = _numeric(farms["fertilizer_kg"]) * _factor(farms["fertilizer_type"], fertilizer_factors) / 1000
+    pesticide = _numeric(farms["pesticide_l"]) * _factor(farms["pesticide_type"], pesticide_factors) / 1000
+    tractor = _numeric(farms["tractor_hours"]) * tractor_factor / 1000
+    irrigation = _factor(farms["irrigation_type"], irrigation_factors) * _numeric(farms["irrigation_hours"]) * area / 1000
+
+    crop *= 1 - np.where(_yes(farms["cover_crop"]), COVER_CROP_REDUCTION, 0.0)
+    irrigation *= 1 - np.where(_yes(farms["renewable_energy"]), RENEWABLE_REDUCTION, 0.0)
+
+    out = pd.DataFrame({
+        key: np.round(values, 2)
+        for key, values in zip(CATEGORIES, (crop, fertilizer, pesticide, tractor, irrigation))
+    }, index=farms.index)
+    out["total"] = np.round(out[list(CATEGORIES)].to_numpy().sum(axis=1), 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["per_hectare"] = np.where(area > 0, out["total"].to_numpy() / area, np.nan)
+    rate = out["per_hectare"].to_numpy()
+    out["band"] = np.select([rate > limit for _, limit in EMITTER_BANDS], [name for name, _ in EMITTER_BANDS], default="Low")
+    out.loc[np.isnan(rate), "band"] = "Unknown"
+    return out
+
+
+def file_format(path):
+    return "parquet" if str(path).lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def read_chunks(source, fmt="csv", chunk_size=100_000):
+    """Yields DataFrames of at most `chunk_size` rows from a path or file object."""
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        import pandas as pd
+
+        yield from pd.read_csv(source, chunksize=chunk_size)
+
+
+def compute_chunks(chunks, keep_inputs=True):
+    """compute() over each chunk; with keep_inputs the input columns come first."""
+    import pandas as pd
+
+    for chunk in chunks:
+        result = compute(chunk)
+        yield pd.concat([chunk, result], axis=1) if keep_inputs else result
+
+
+def write_chunks(results, destination, fmt="csv"):
+    """Writes result chunks to one CSV or Parquet file; returns the row count."""
+    rows = 0
+    writer = None
+    try:
+        for i, result in enumerate(results):
+            if fmt == "parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(result, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(destination, table.schema)
+                writer.write_table(table)
+            else:
+                result.to_csv(destination, mode="w" if i == 0 else "a", header=i == 0, index=False)
+            rows += len(result)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="roster as .csv or .parquet")
+    parser.add_argument("destination", help="results as .csv or .parquet")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--results-only", action="store_true", help="leave the input columns out of the output")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        sys.exit(f"No such file: {args.source}")
+    started = time.perf_counter()
+    chunks = read_chunks(args.source, file_format(args.source), args.chunk_size)
+    try:
+        rows = write_chunks(compute_chunks(chunks, keep_inputs=not args.results_only), args.destination, file_format(args.destination))
+    except (ValueError, KeyError) as e:
+        sys.exit(f"Could not compute footprints: {e}")
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {rows} farms to {args.destination} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} farms/s).")
+
+
+if __name__ == "__main__":
+    main()
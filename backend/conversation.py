@@ -0,0 +1,255 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Prompt for folding old turns into the rolling summary; {summary} may be empty.
+SUMMARY_PROMPT = (
+    "You maintain the running summary of a conversation between a farmer and EcoBot.\n"
+    "Current summary:\n{summary}\n\n"
+    "Newer exchanges:\n{transcript}\n\n"
+    "Write the updated summary in at most {max_words} words. Keep the farmer's crops, location, "
+    "problems, numbers and any advice already given; drop pleasantries."
+)
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count: ~4 UTF-8 bytes per token, which also holds for Devanagari
+    (3 bytes per character, a bit under one token each). No tokenizer download needed."""
+    return math.ceil(len(text.encode("utf-8")) / 4) + 4  # + per-message framing
+
+
+class PromptTooLong(ValueError):
+    pass
+
+
+class Session:
+    __slots__ = ("summary", "turns", "compacting")
+
+    def __init__(self, summary="", turns=(), compacting=False):
+        self.summary = summary
+        self.turns = list(turns)  # (question, answer, tokens), oldest first
+        self.compacting = compacting
+
+    @property
+    def empty(self):
+        return not self.summary and not self.turns
+
+
+class MemorySessions:
+    """Sessions in this process's memory, least recently used evicted beyond `capacity`
+    and expired after `ttl_seconds` idle. storage.SessionTable is the shared equivalent."""
+
+    def __init__(self, capacity=50000, ttl_seconds=24 * 3600):
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self._sessions = OrderedDict()  # id -> (Session, touched), least recently used first
+        self._lock = threading.Lock()
+        self.counters = {"evicted": 0, "expired": 0}
+
+    @contextmanager
+    def edit(self, session_id, create=False):
+        """The session (None if it doesn't exist and not `create`), locked for the block."""
+        with self._lock:
+            yield self._get(session_id, create)
+
+    def get(self, session_id):
+        """A copy of the session for reading, or None; doesn't count as a use."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                return None
+            session = entry[0]
+            return Session(session.summary, session.turns, session.compacting)
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _get(self, session_id, create):
+        now = time.monotonic()
+        # Idle sessions sit at the front, so expiring them costs nothing while none are due.
+        while self._sessions:
+            _, touched = next(iter(self._sessions.values()))
+            if now - touched <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.counters["expired"] += 1
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            if not create:
+                return None
+            entry = (Session(), now)
+            self._sessions[session_id] = entry
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+                self.counters["evicted"] += 1
+        self._sessions[session_id] = (entry[0], now)
+        self._sessions.move_to_end(session_id)
+        return entry[0]
+
+
+class ConversationMemory:
+    """Per-session chat history that always fits a fixed prompt budget.
+
+    Each prompt is the stable system prompt, then the rolling summary of older turns
+    (as a user/model pair, since Gemini folds every system message into one
+    instruction), then the newest turns that fit in `budget_tokens`, then the question.
+    The prefix only changes when turns are folded into the summary, which happens
+    once the kept turns pass `budget_tokens` and folds them down to half of it, so
+    consecutive requests of a session share a long prefix for upstream prompt caching.
+
+    Sessions live in `sessions`: MemorySessions (the default, one process) or
+    storage.SessionTable (SQLite, shared by every API worker), which evict them least
+    recently used beyond their capacity and after a TTL. Per-session memory is bounded
+    too: turns beyond twice the budget are dropped if summarizing keeps failing.
+
+    history, record and is_empty block on the session store; async callers run them
+    via asyncio.to_thread, as acompact does for its own reads and writes.
+    """
+
+    def __init__(self, system_prompt, summarizer=None, budget_tokens=2000, summary_tokens=300, sessions=None):
+        self.system_prompt = system_prompt
+        self.summarizer = summarizer  # Runnable: {"summary", "transcript", "max_words"} -> str
+        self.budget = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.sessions = sessions if sessions is not None else MemorySessions()
+        self._lock = threading.Lock()  # counters
+        self._tasks = set()
+        self.counters = {"turns": 0, "compactions": 0, "compaction_failures": 0, "turns_dropped": 0}
+
+    def history(self, session_id, query):
+        """Chat messages for `query` within the budget, as (role, text) tuples for a MessagesPlaceholder."""
+        fixed = estimate_tokens(self.system_prompt) + estimate_tokens(query)
+        if fixed > self.budget:
+            raise PromptTooLong(f"Question is about {fixed} tokens; the limit is {self.budget}.")
+        session = self.sessions.get(session_id)
+        if session is None:
+            return []
+        summary, turns = session.summary, session.turns
+        messages, remaining = [], self.budget - fixed
+        if summary:
+            messages = [("human", f"Summary of our conversation so far: {summary}"), ("ai", "Noted.")]
+            cost = sum(estimate_tokens(text) for _, text in messages)
+            if cost <= remaining:
+                remaining -= cost
+            else:
+                messages = []
+        recent = []
+        # Newest first, stopping at the first turn that doesn't fit, so the kept turns stay contiguous.
+        for question, answer, tokens in reversed(turns):
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            recent[:0] = [("human", question), ("ai", answer)]
+        return messages + recent
+
+    def record(self, session_id, query, answer):
+        """Adds a finished turn; True when the session should now be compacted."""
+        tokens = estimate_tokens(query) + estimate_tokens(answer)
+        dropped = 0
+        with self.sessions.edit(session_id, create=True) as session:
+            session.turns.append((query, answer, tokens))
+            kept = sum(t for _, _, t in session.turns)
+            # Only when no compaction is reading the oldest turns; it removes them itself.
+            while not session.compacting and kept > 2 * self.budget and len(session.turns) > 1:
+                kept -= session.turns.pop(0)[2]
+                dropped += 1
+            compact = kept > self.budget and not session.compacting and self.summarizer is not None
+            session.compacting = session.compacting or compact
+        self._count(turns=1, turns_dropped=dropped)
+        return compact
+
+    def is_empty(self, session_id):
+        session = self.sessions.get(session_id)
+        return session is None or session.empty
+
+    def clear(self, session_id):
+        return self.sessions.delete(session_id)
+
+    def compact(self, session_id):
+        """Folds the oldest turns into the summary with one summarizer call (blocking)."""
+        folded = self._take_oldest(session_id)
+        if folded is None:
+            return
+        try:
+            summary = self.summarizer.invoke(self._summary_inputs(folded))
+        except Exception:
+            self._finish(folded, None)
+            raise
+        self._finish(folded, summary)
+
+    async def acompact(self, session_id):
+        folded = await asyncio.to_thread(self._take_oldest, session_id)
+        if folded is None:
+            return
+        try:
+            summary = await self.summarizer.ainvoke(self._summary_inputs(folded))
+        except Exception:
+            await asyncio.to_thread(self._finish, folded, None)
+            raise
+        await asyncio.to_thread(self._finish, folded, summary)
+
+    def compact_in_background(self, session_id):
+        """Schedules acompact on the running loop; the answer is not held up by the summary."""
+        task = asyncio.get_running_loop().create_task(self.acompact(session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._compaction_done)
+        return task
+
+    def _compaction_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()  # already counted in compaction_failures
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, **self.sessions.counters, "sessions": len(self.sessions), "capacity": self.sessions.capacity, "budget_tokens": self.budget}
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def _take_oldest(self, session_id):
+        with self.sessions.edit(session_id) as session:
+            if session is None:
+                return None
+            kept = sum(t for _, _, t in session.turns)
+            count = 0
+            while count < len(session.turns) - 1 and kept > self.budget // 2:
+                kept -= session.turns[count][2]
+                count += 1
+            if not count:
+                session.compacting = False
+                return None
+            return session_id, session.summary, session.turns[:count]
+
+    def _summary_inputs(self, folded):
+        _, summary, turns = folded
+        transcript = "\n".join(f"Farmer: {q}\nEcoBot: {a}" for q, a, _ in turns)
+        return {"summary": summary or "(none yet)", "transcript": transcript, "max_words": int(self.summary_tokens * 0.75)}
+
+    def _finish(self, folded, summary):
+        session_id, _, turns = folded
+        with self.sessions.edit(session_id) as session:
+            if session is None:
+                return  # cleared or evicted meanwhile
+            session.compacting = False
+            # Turns recorded meanwhile were appended after the folded ones, which are still first.
+            if summary is not None and session.turns[:len(turns)] == turns:
+                session.turns = session.turns[len(turns):]
+                session.summary = _truncate_tokens(summary.strip(), self.summary_tokens)
+        self._count(**{"compactions" if summary is not None else "compaction_failures": 1})
+
+
+def _truncate_tokens(text, max_tokens):
+    data = text.encode("utf-8")
+    limit = max_tokens * 4
+    return text if len(data) <= limit else data[:limit].decode("utf-8", errors="ignore").rsplit(" ", 1)[0] + " ..."
@@ -0,0 +1,84 @@
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import ConfigDict
+
+from llm_gateway import LLMGateway
+
+# Keys of the OpenAPI subset Gemini accepts in responseSchema.
+_SCHEMA_KEYS = {"type", "description", "enum", "properties", "required", "items", "nullable", "format"}
+
+
+def gemini_schema(json_schema):
+    """Pydantic JSON schema -> Gemini responseSchema (inlines $refs, drops titles and the like)."""
+    defs = json_schema.get("$defs", {})
+
+    def convert(node):
+        if "$ref" in node:
+            node = defs[node["$ref"].rsplit("/", 1)[-1]]
+        out = {key: value for key, value in node.items() if key in _SCHEMA_KEYS}
+        if "enum" in out and "type" not in out:
+            out["type"] = "string"
+        if "properties" in out:
+            out["properties"] = {name: convert(child) for name, child in out["properties"].items()}
+        if "items" in out:
+            out["items"] = convert(out["items"])
+        return out
+
+    return convert(json_schema)
+
+
+class GatewayChatModel(BaseChatModel):
+    """LangChain chat model that sends every call through an LLMGateway.
+
+    Drop-in for ChatGoogleGenerativeAI in `prompt | llm | StrOutputParser()` chains,
+    including astream() and with_structured_output(); text-only messages.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    gateway: LLMGateway
+    model: str = "gemini-1.5-flash"
+    temperature: float | None = None
+    response_schema: dict | None = None
+
+    @property
+    def _llm_type(self):
+        return "gemini-gateway"
+
+    def _request(self, messages):
+        system = "\n".join(m.content for m in messages if isinstance(m, SystemMessage)) or None
+        contents = [
+            {"role": "model" if isinstance(m, AIMessage) else "user", "parts": [{"text": m.text}]}
+            for m in messages if not isinstance(m, SystemMessage)
+        ]
+        config = {}
+        if self.temperature is not None:
+            config["temperature"] = self.temperature
+        if self.response_schema is not None:
+            config["responseMimeType"] = "application/json"
+            config["responseSchema"] = self.response_schema
+        return {"model": self.model, "contents": contents, "system": system, "generation_config": config or None}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.gateway.generate_sync(**self._request(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = await self.gateway.generate(**self._request(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for text in self.gateway.stream(**self._request(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema: Any, **kwargs):
+        """Gemini JSON mode constrained to the pydantic model's schema, parsed back into it."""
+        json_model = self.model_copy(update={"response_schema": gemini_schema(schema.model_json_schema())})
+        return json_model | RunnableLambda(lambda message: schema.model_validate_json(message.content))
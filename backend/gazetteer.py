@@ -0,0 +1,185 @@
+import bisect
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "india_gazetteer.csv")
+
+_NON_WORD = re.compile(r"[^a-z0-9\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_place(text):
+    """Lowercase, drop punctuation and collapse whitespace: "Nashik, MH." -> "nashik mh"."""
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", text.lower())).strip()
+
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b):
+    """Levenshtein distance: insertions, deletions and substitutions to turn `a` into `b`."""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def resolve_edits(length):
+    """Typos a misspelling of `length` characters may have and still resolve: 1 below 10, else 2.
+
+    Two edits from 8 letters would already resolve the village Chandpur to Chandrapur.
+    """
+    return 1 if length < 10 else 2
+
+
+class Gazetteer:
+    """Offline place-name -> Indian state resolver over a CSV of (name, kind, state) rows.
+
+    Exact names resolve with one dict lookup, prefixes ("Nash") with a bisect over the
+    sorted names, and misspellings ("Nasik", "Vishakapatnam") through a trigram index:
+    only names sharing a trigram with the query are scored, by Dice coefficient.
+    The bundled file covers states, union territories, district headquarters and major
+    towns; point GAZETTEER_PATH at a fuller export (e.g. census villages) with the
+    same columns.
+
+    Only exact names, and misspellings within `max_edits(len(query))` edits of a name
+    ("Nasik", "Bhubaneshwar", "Vishakapatnam") come back with "resolved": True, and a
+    misspelling only when every name that close is in one state. Prefix and looser
+    fuzzy matches are suggestions: an unlisted village such as Chandpur scores 0.78
+    against Churachandpur, in another state, so callers should still ask the geocoder.
+    """
+
+    def __init__(self, path=DEFAULT_GAZETTEER, min_score=0.45, max_edits=resolve_edits):
+        self.min_score = min_score
+        self.max_edits = max_edits
+        self.entries = []  # (display name, kind, state)
+        self._by_name = {}  # normalized name -> entry ids (a name can exist in several states)
+        self._trigram_index = {}
+        self._state_names = set()
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                self._add(row["name"], row["kind"], row["state"])
+        self._sorted_names = sorted(self._by_name)
+        self._name_trigrams = {name: trigrams(name) for name in self._by_name}
+        for name, grams in self._name_trigrams.items():
+            for gram in grams:
+                self._trigram_index.setdefault(gram, []).append(name)
+
+    def _add(self, name, kind, state):
+        normalized = normalize_place(name)
+        self._by_name.setdefault(normalized, []).append(len(self.entries))
+        self.entries.append((name, kind, state))
+        if kind == "state":
+            self._state_names.add(normalized)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _matches(self, name, score, how, resolved=False):
+        return [{"name": self.entries[i][0], "kind": self.entries[i][1], "state": self.entries[i][2], "score": round(score, 3), "match": how, "resolved": resolved}
+                for i in self._by_name[name]]
+
+    def _lookup(self, query, limit):
+        if query in self._by_name:
+            return self._matches(query, 1.0, "exact", resolved=True)
+        results = []
+        if len(query) >= 3:
+            i = bisect.bisect_left(self._sorted_names, query)
+            while i < len(self._sorted_names) and self._sorted_names[i].startswith(query) and len(results) < limit:
+                name = self._sorted_names[i]
+                results += self._matches(name, len(query) / len(name), "prefix")
+                i += 1
+        if results:
+            return results
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for name in self._trigram_index.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        scored = sorted(((2 * n / (len(grams) + len(self._name_trigrams[name])), name) for name, n in shared.items()), reverse=True)
+        candidates = [(score, name) for score, name in scored[:limit] if score >= self.min_score]
+        close = {name for _, name in candidates if edit_distance(query, name) <= self.max_edits(len(query))}
+        # A typo equally close to names in two states says nothing about which one was meant.
+        unambiguous = len({self.entries[i][2] for name in close for i in self._by_name[name]}) == 1
+        for score, name in candidates:
+            results += self._matches(name, score, "fuzzy", unambiguous and name in close)
+        return results
+
+    def resolve(self, query, limit=5):
+        """Candidate matches for a free-text place, resolved ones first, then by score.
+
+        "Village, District, State" style input is split on commas; a part naming a state
+        narrows the candidates of the other parts to that state, and resolves to the
+        state itself when none of them is resolved.
+        """
+        parts = [normalize_place(part) for part in query.split(",")]
+        parts = [part for part in parts if part]
+        if not parts:
+            return []
+        whole = normalize_place(query)
+        states = {self.entries[self._by_name[p][0]][2] for p in parts if p in self._state_names}
+        results = self._lookup(whole, limit)
+        if not results or len(parts) > 1:
+            for part in parts:
+                if part not in self._state_names:
+                    results += self._lookup(part, limit)
+        if states:
+            results = [r for r in results if r["state"] in states]
+            if not any(r["resolved"] for r in results):
+                results += [{"name": s, "kind": "state", "state": s, "score": 1.0, "match": "exact", "resolved": True} for s in states]
+        seen, unique = set(), []
+        for result in sorted(results, key=lambda r: (not r["resolved"], -r["score"])):
+            key = (result["name"], result["state"])
+            if key not in seen:
+                seen.add(key)
+                unique.append(result)
+        return unique[:limit]
+
+
+class GeocodeFallback:
+    """Nominatim lookups for places the gazetteer doesn't know, cached in SQLite.
+
+    Answers (including "not found") are kept for `ttl_seconds`, so each distinct
+    query hits the public service at most once per TTL whatever the traffic.
+    Requires geopy.
+    """
+
+    def __init__(self, cache_path="geocode_cache.db", ttl_seconds=30 * 24 * 3600, timeout=5, user_agent="agrosage"):
+        self.ttl = ttl_seconds
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self._geocoder = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS geocode (query TEXT PRIMARY KEY, created REAL NOT NULL, result TEXT)")
+        self._db.commit()
+
+    def geocode(self, query):
+        """{"address": ..., "state": ...} or None; raises on network errors (not cached)."""
+        key = normalize_place(query)
+        with self._lock:
+            row = self._db.execute("SELECT created, result FROM geocode WHERE query = ?", (key,)).fetchone()
+        if row and time.time() - row[0] < self.ttl:
+            return json.loads(row[1])
+        if self._geocoder is None:
+            from geopy.geocoders import Nominatim
+
+            self._geocoder = Nominatim(user_agent=self.user_agent, timeout=self.timeout)
+        location = self._geocoder.geocode(query, addressdetails=True, country_codes="in")
+        result = None
+        if location:
+            result = {"address": location.address, "state": location.raw.get("address", {}).get("state")}
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO geocode (query, created, result) VALUES (?, ?, ?)", (key, time.time(), json.dumps(result)))
+            self._db.commit()
+        return result
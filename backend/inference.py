@@ -0,0 +1,303 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+
+from metrics import stage
+
+CAPTION_MODEL_ID = "Salesforce/blip-image-captioning-base"
+# The original app's generation budget; a lower CAPTION_MAX_NEW_TOKENS is an opt-in trade-off.
+DEFAULT_MAX_NEW_TOKENS = 50
+
+_STOP = object()
+
+
+class CaptionEngine:
+    """BLIP captioner with explicit CPU thread and decoding settings.
+
+    Subclasses only change how the model is prepared in `_load_model`; preprocessing,
+    generation and decoding are shared so engines stay comparable in the parity check.
+    """
+
+    name = "torch"
+
+    def __init__(self, model_id=CAPTION_MODEL_ID, max_new_tokens=DEFAULT_MAX_NEW_TOKENS, num_beams=1, intra_op_threads=None, inter_op_threads=None):
+        self.model_id = model_id
+        self.generate_kwargs = {"max_new_tokens": max_new_tokens, "num_beams": num_beams}
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.processor = None
+        self.model = None
+
+    def load(self):
+        import torch
+        from transformers import BlipProcessor
+
+        if self.intra_op_threads:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                pass  # can only be set once per process, before any parallel work ran
+        self.processor = BlipProcessor.from_pretrained(self.model_id)
+        self.model = self._load_model().eval()
+        return self
+
+    def _load_model(self):
+        from transformers import BlipForConditionalGeneration
+
+        return BlipForConditionalGeneration.from_pretrained(self.model_id)
+
+    def caption_batch(self, images):
+        """Captions a batch of PIL images in one padded forward pass."""
+        import torch
+
+        with stage("caption_preprocess"):
+            inputs = self.processor(images=images, return_tensors="pt")
+        with stage("caption_generate"), torch.inference_mode():
+            out = self.model.generate(**inputs, **self.generate_kwargs)
+        return [caption.strip() for caption in self.processor.batch_decode(out, skip_special_tokens=True)]
+
+
+class QuantizedCaptionEngine(CaptionEngine):
+    """Dynamic int8 quantization of every Linear layer (weights int8, activations quantized per batch)."""
+
+    name = "int8"
+
+    def _load_model(self):
+        import torch
+
+        model = super()._load_model().eval()
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxCaptionEngine(CaptionEngine):
+    """Runs the ViT image encoder (the fixed per-image cost) in ONNX Runtime.
+
+    BLIP's autoregressive text decoder stays in PyTorch and is int8-quantized; the
+    exported encoder is cached in `onnx_dir` and optionally quantized to int8 as well.
+    """
+
+    name = "onnx"
+
+    def __init__(self, *args, onnx_dir="onnx_cache", quantize_encoder=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.onnx_dir = onnx_dir
+        self.quantize_encoder = quantize_encoder
+
+    def _load_model(self):
+        import torch
+        import onnxruntime as ort
+
+        model = super()._load_model().eval()
+        encoder_path = self._export_encoder(model)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.intra_op_threads or 0
+        options.inter_op_num_threads = self.inter_op_threads or 0
+        session = ort.InferenceSession(encoder_path, options, providers=["CPUExecutionProvider"])
+        model.vision_model = _onnx_vision_model(session)
+        model.text_decoder = torch.ao.quantization.quantize_dynamic(model.text_decoder, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def _export_encoder(self, model):
+        import torch
+
+        os.makedirs(self.onnx_dir, exist_ok=True)
+        path = os.path.join(self.onnx_dir, "blip_vision.onnx")
+        if not os.path.exists(path):
+            size = model.config.vision_config.image_size
+            encoder = _vision_encoder_for_export(model.vision_model)
+            torch.onnx.export(
+                encoder, (torch.zeros(1, 3, size, size),), path,
+                input_names=["pixel_values"], output_names=["image_embeds"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                opset_version=17,
+            )
+        if not self.quantize_encoder:
+            return path
+        quantized_path = os.path.join(self.onnx_dir, "blip_vision.int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+        return quantized_path
+
+
+def _onnx_vision_model(session):
+    """Drop-in for BlipForConditionalGeneration.vision_model backed by an ONNX Runtime session."""
+    import torch
+
+    class OnnxVisionModel(torch.nn.Module):
+        def forward(self, pixel_values, **kwargs):
+            (image_embeds,) = session.run(None, {"pixel_values": pixel_values.numpy()})
+            return (torch.from_numpy(image_embeds),)
+
+    return OnnxVisionModel()
+
+
+def _vision_encoder_for_export(vision_model):
+    import torch
+
+    class VisionEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.vision_model = vision_model
+
+        def forward(self, pixel_values):
+            return self.vision_model(pixel_values=pixel_values)[0]
+
+    return VisionEncoder().eval()
+
+
+CAPTION_ENGINES = {engine.name: engine for engine in (CaptionEngine, QuantizedCaptionEngine, OnnxCaptionEngine)}
+
+
+# Set by the pre-fork master in serve.py: forked workers caption with its weights.
+_shared_engine = None
+
+
+def share_caption_engine(engine):
+    global _shared_engine
+    _shared_engine = engine
+
+
+def shared_caption_engine():
+    """The engine loaded before this worker was forked, or None."""
+    return _shared_engine
+
+
+def make_caption_engine(name=None, **overrides):
+    """Builds the engine chosen by CAPTION_ENGINE (torch, int8 or onnx) with its env settings."""
+    name = name or os.getenv("CAPTION_ENGINE", "torch")
+    if name not in CAPTION_ENGINES:
+        raise ValueError(f"Unknown caption engine '{name}', expected one of {sorted(CAPTION_ENGINES)}")
+    settings = {
+        "max_new_tokens": int(os.getenv("CAPTION_MAX_NEW_TOKENS", DEFAULT_MAX_NEW_TOKENS)),
+        "num_beams": int(os.getenv("CAPTION_NUM_BEAMS", "1")),
+        "intra_op_threads": int(os.getenv("CAPTION_THREADS", "0")) or None,
+        "inter_op_threads": int(os.getenv("CAPTION_INTEROP_THREADS", "0")) or None,
+    }
+    if name == "onnx":
+        settings["onnx_dir"] = os.getenv("CAPTION_ONNX_DIR", "onnx_cache")
+        settings["quantize_encoder"] = os.getenv("CAPTION_ONNX_INT8", "0") == "1"
+    settings.update(overrides)
+    return CAPTION_ENGINES[name](**settings)
+
+
+class CaptionBatcher:
+    """Gathers concurrent caption requests into batched model calls on a worker thread.
+
+    `caption_batch` receives a list of PIL images and must return one caption per image;
+    a batch whose result doesn't match fails all of its requests. A batch is flushed
+    once it holds `max_batch_size` images or `max_wait_ms` has passed since its first
+    image arrived, so a lone request waits at most `max_wait_ms`. Requests still queued
+    when `stop` gives up waiting, or made while stopped, fail with RuntimeError.
+    """
+
+    def __init__(self, caption_batch, max_batch_size=8, max_wait_ms=20):
+        self.caption_batch = caption_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()  # no request is queued behind _STOP
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # A fresh queue, so a thread that stop() gave up on can't take the new thread's requests.
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="caption-batcher", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            requests = self._queue
+            requests.put(_STOP)
+        # The worker captions everything queued before _STOP unless the timeout runs out first.
+        thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        if thread.is_alive() and _STOP in leftover:
+            requests.put(_STOP)  # still busy with a batch; let it exit afterwards
+        _fail([item for item in leftover if item is not _STOP], RuntimeError("Caption batcher stopped"))
+
+    async def caption(self, image):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._thread is None:
+                raise RuntimeError("Caption batcher is not running")
+            self._queue.put((image, future, loop))
+        return await future
+
+    def _collect(self, requests, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                requests.put(_STOP)
+                break
+            batch.append(item)
+        # Requests whose client went away while queued are dropped before the forward pass.
+        return [item for item in batch if not item[1].cancelled()]
+
+    def _run(self, requests):
+        while True:
+            first = requests.get()
+            if first is _STOP:
+                return
+            batch = self._collect(requests, first)
+            if not batch:
+                continue
+            try:
+                captions = list(self.caption_batch([image for image, _, _ in batch]))
+                if len(captions) != len(batch):
+                    raise RuntimeError(f"caption_batch returned {len(captions)} captions for {len(batch)} images")
+            except Exception as e:
+                _fail(batch, e)
+                continue
+            for (_, future, loop), caption in zip(batch, captions):
+                _call(loop, future, caption, None)
+
+
+def _fail(items, error):
+    for _, future, loop in items:
+        _call(loop, future, None, error)
+
+
+def _call(loop, future, result, error):
+    try:
+        loop.call_soon_threadsafe(_resolve, future, result, error)
+    except RuntimeError:
+        pass  # the request's event loop is already closed
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
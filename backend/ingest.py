@@ -0,0 +1,92 @@
+import io
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from scan_cache import content_hasher
+
+CHUNK_SIZE = 64 * 1024
+# Room for multipart boundaries and part headers on top of a file-size limit.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class BodyLimit:
+    """ASGI middleware that rejects request bodies larger than a per-path limit with 413.
+
+    The declared Content-Length is checked before the route runs, and the streamed
+    body is counted as it arrives, so an oversized upload never gets spooled whole.
+    `limits` maps a path to a byte limit for the file it carries.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            return await self.app(scope, receive, send)
+        limit = max_bytes + MULTIPART_OVERHEAD
+        detail = f"Upload larger than {max_bytes // (1024 * 1024)} MB"
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(file, max_bytes):
+    """Hashes an UploadFile chunk by chunk, rejecting it with 413 as soon as it passes `max_bytes`.
+
+    Returns the scan-cache content key. The bytes are hashed straight from the spooled
+    upload and the file is rewound for decode_image, so no copy of it is ever built.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes // (1024 * 1024)} MB")
+    digest = content_hasher()
+    size = 0
+    while chunk := await file.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes // (1024 * 1024)} MB")
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+def decode_image(source, min_side):
+    """Decodes an upload file object straight to RGB with its shorter side at most `min_side` pixels.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale in the DCT domain (PIL draft), so a
+    12 MP photo never materialises at full resolution; what remains is one resize.
+    """
+    try:
+        image = Image.open(source)
+        if image.format == "JPEG":
+            image.draft("RGB", (min_side, min_side))
+        image = image.convert("RGB")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {e}")
+    shorter = min(image.size)
+    if shorter > min_side:
+        scale = min_side / shorter
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.BICUBIC, reducing_gap=2.0)
+    return image
+
+
+def encode_jpeg(image, quality=85):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
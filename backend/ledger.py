@@ -0,0 +1,353 @@
+import fcntl
+import glob
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+import numpy as np
+
+# One ledger entry per fixed-width record, so position i lives at HEADER + i * 128 and the
+# columns can be read straight out of the memory map.
+RECORD = np.dtype([("seq", "<u8"), ("ts_ms", "<i8"), ("credits", "<i4"), ("length", "<u2"), ("activity", "S106")])
+MAGIC = b"AGLEDGR1"
+HEADER_SIZE = RECORD.itemsize  # magic, source database id, padding; keeps records aligned
+SEGMENT_RECORDS = 1 << 20  # 128 MB per segment file
+SPARSE_EVERY = 256  # one in-memory index entry per 256 records (8 pages of the map)
+
+PERIODS = ("day", "month", "season")
+DAY_MS = 86_400_000
+
+
+def season_of(year, month):
+    """Indian cropping season (label, first month as (year, month)) for a calendar month."""
+    if 6 <= month <= 10:
+        return f"Kharif {year}", (year, 6)
+    if month >= 11:
+        return f"Rabi {year}-{(year + 1) % 100:02d}", (year, 11)
+    if month <= 3:
+        return f"Rabi {year - 1}-{year % 100:02d}", (year - 1, 11)
+    return f"Zaid {year}", (year, 4)
+
+
+def parse_timestamp_ms(value):
+    """ISO timestamp -> epoch ms. Naive values (datetime.now().isoformat()) are local time."""
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+
+
+def format_timestamp(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class PeriodRollup:
+    """Credits and entry counts per day, month or season, kept in time order as entries arrive."""
+
+    def __init__(self, period, utc_offset_ms):
+        self.period = period
+        self.offset = utc_offset_ms
+        self.starts = []  # bucket start, epoch ms
+        self.ends = []  # start of the following period; buckets with no entries are skipped
+        self.labels = []
+        self.credits = []
+        self.entries = []
+        self._next_start = None
+
+    def _bucket(self, ts_ms):
+        local = datetime.fromtimestamp((ts_ms + self.offset) / 1000, timezone.utc)
+        if self.period == "day":
+            label, first = local.strftime("%Y-%m-%d"), (local.year, local.month, local.day)
+        elif self.period == "month":
+            label, first = local.strftime("%Y-%m"), (local.year, local.month, 1)
+        else:
+            label, (year, month) = season_of(local.year, local.month)
+            first = (year, month, 1)
+        start = int(datetime(*first, tzinfo=timezone.utc).timestamp() * 1000) - self.offset
+        return label, start
+
+    def add(self, ts_ms, credits):
+        """Adds a batch of entries (numpy arrays, in time order): one step per bucket touched."""
+        position = 0
+        while position < len(ts_ms):
+            # Only the newest bucket can still change; open the next one when an entry passes it.
+            if not self.starts or ts_ms[position] >= self._next_start:
+                label, start = self._bucket(int(ts_ms[position]))
+                self.starts.append(start)
+                self.labels.append(label)
+                self.credits.append(0)
+                self.entries.append(0)
+                self._next_start = self._bucket_end(start)
+                self.ends.append(self._next_start)
+            end = int(np.searchsorted(ts_ms, self._next_start, side="left"))
+            self.credits[-1] += int(credits[position:end].sum())
+            self.entries[-1] += end - position
+            position = end
+
+    def _bucket_end(self, start):
+        # The day after the bucket's last day: jump ahead, then snap back to a bucket start.
+        span = {"day": 1, "month": 32, "season": 160}[self.period] * DAY_MS
+        probe = start + span
+        while True:
+            label, probe_start = self._bucket(probe)
+            if probe_start > start:
+                return probe_start
+            probe += DAY_MS
+
+    def query(self, start_ms, end_ms):
+        """Buckets overlapping [start_ms, end_ms), oldest first: O(log n) plus the buckets returned."""
+        first = bisect_right(self.ends, start_ms) if start_ms is not None else 0
+        last = bisect_left(self.starts, end_ms) if end_ms is not None else len(self.starts)
+        return [
+            {"period": self.labels[i], "start": format_timestamp(self.starts[i]), "credits": self.credits[i], "entries": self.entries[i]}
+            for i in range(first, last)
+        ]
+
+
+class CarbonLedger:
+    """Append-only carbon credit ledger in fixed-width segment files, memory-mapped for reads.
+
+    The SQLite carbon_ledger table stays the system of record (mission completion
+    commits there); `sync` appends every row the segments don't have yet, in id order,
+    under an exclusive file lock, so any number of worker processes can call it after
+    their writes. Segment headers carry the id of the database they were copied from;
+    `verify` rebuilds the segments when the database was replaced or reset, and
+    deleting the directory rebuilds it from SQLite on the next sync.
+
+    Every process keeps, for the entries it has mapped:
+    - a sparse index (every SPARSE_EVERY-th timestamp and id), so a time or cursor
+      lookup is a binary search in memory plus one within a single block of the map,
+    - a running credit total, so the credits of any time range are one subtraction,
+    - day, month and season (Kharif/Rabi/Zaid) rollups, updated as entries are read in.
+    Timestamps are kept non-decreasing (a clock step back is clamped to the previous
+    entry), which the binary searches rely on. Day and month boundaries follow
+    `utc_offset_minutes` (IST by default).
+    """
+
+    def __init__(self, directory, source_id="", utc_offset_minutes=330, fsync=False):
+        self.directory = directory
+        self.source_id = source_id
+        self.fsync = fsync
+        self.offset = utc_offset_minutes * 60_000
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._clear()
+        self.refresh()
+
+    def _clear(self):
+        self._segments = []  # np.memmap per segment, the last one possibly partial
+        self._count = 0
+        self._sparse_ts = []
+        self._sparse_seq = []
+        self._cumulative = np.zeros(1, dtype=np.int64)  # credits before position i
+        self.rollups = {period: PeriodRollup(period, self.offset) for period in PERIODS}
+
+    # --- segment files ---
+    def _segment_path(self, index):
+        return os.path.join(self.directory, f"ledger-{index:06d}.seg")
+
+    def _records_in(self, path):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return max(0, (size - HEADER_SIZE) // RECORD.itemsize)
+
+    def _header(self):
+        return (MAGIC + self.source_id.encode("utf-8")).ljust(HEADER_SIZE, b"\0")
+
+    def _map(self, index, records):
+        if not records:
+            return np.zeros(0, dtype=RECORD)
+        with open(self._segment_path(index), "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self._segment_path(index)} is not a ledger segment")
+        return np.memmap(self._segment_path(index), dtype=RECORD, mode="r", offset=HEADER_SIZE, shape=(records,))
+
+    def refresh(self):
+        """Maps entries appended since the last call (by any process) and indexes them."""
+        with self._lock:
+            while True:
+                index = len(self._segments) - 1 if self._segments and len(self._segments[-1]) < SEGMENT_RECORDS else len(self._segments)
+                mapped = len(self._segments[index]) if index < len(self._segments) else 0
+                records = self._records_in(self._segment_path(index))
+                if records <= mapped:
+                    return
+                segment = self._map(index, records)
+                if index < len(self._segments):
+                    self._segments[index] = segment
+                else:
+                    self._segments.append(segment)
+                self._index(segment[mapped:])
+
+    def _index(self, new):
+        start = self._count
+        ts, seq, credits = np.asarray(new["ts_ms"]), np.asarray(new["seq"]), np.asarray(new["credits"], dtype=np.int64)
+        first_sparse = -start % SPARSE_EVERY
+        self._sparse_ts += ts[first_sparse::SPARSE_EVERY].tolist()
+        self._sparse_seq += seq[first_sparse::SPARSE_EVERY].tolist()
+        end = start + len(new)
+        if end + 1 > len(self._cumulative):  # grown by doubling, so appends stay amortized O(1)
+            grown = np.zeros(max(end + 1, 2 * len(self._cumulative)), dtype=np.int64)
+            grown[:start + 1] = self._cumulative[:start + 1]
+            self._cumulative = grown
+        self._cumulative[start + 1:end + 1] = self._cumulative[start] + np.cumsum(credits)
+        for rollup in self.rollups.values():
+            rollup.add(ts, credits)
+        self._count = end
+
+    def _column(self, name, lo, hi):
+        """Values of column `name` for positions [lo, hi), which may cross a segment boundary."""
+        parts = []
+        while lo < hi:
+            segment, offset = divmod(lo, SEGMENT_RECORDS)
+            take = min(hi - lo, SEGMENT_RECORDS - offset)
+            parts.append(self._segments[segment][name][offset:offset + take])
+            lo += take
+        return np.concatenate(parts) if len(parts) > 1 else (parts[0] if parts else np.zeros(0, dtype=RECORD[name]))
+
+    def _search(self, name, sparse, value, side):
+        """Position where `value` would go in the sorted column `name`: a binary search of the
+        sparse index picks the block, and only that block of the map is searched."""
+        block = (bisect_left(sparse, value) if side == "left" else bisect_right(sparse, value)) - 1
+        if block < 0:
+            return 0
+        lo, hi = block * SPARSE_EVERY, min(self._count, (block + 1) * SPARSE_EVERY)
+        return lo + int(np.searchsorted(self._column(name, lo, hi), value, side=side))
+
+    # --- writes ---
+    def verify(self, entry):
+        """Rebuilds the segments unless they were copied from this database: same source_id
+        in the header, and entry(last_id) -> {activity, credits} | None still returns the
+        last entry unchanged. Call before the first sync; True when the segments were dropped."""
+        with self._lock, self._file_lock():
+            self.refresh()
+            last = self._last()
+            if last is None:
+                return False
+            with open(self._segment_path(0), "rb") as f:
+                header = f.read(HEADER_SIZE)
+            row = entry(int(last["seq"]))
+            if header == self._header() and row is not None and row["credits"] == int(last["credits"]) and self._encode(row["activity"]) == bytes(last["activity"]):
+                return False
+            for path in glob.glob(os.path.join(self.directory, "ledger-*.seg")):
+                os.unlink(path)  # other processes keep reading their maps until they verify too
+            self._clear()
+            return True
+
+    def _file_lock(self):
+        return _FileLock(os.path.join(self.directory, "ledger.lock"))
+
+    def sync(self, rows_after):
+        """Appends what rows_after(last_id) returns, [{id, timestamp, activity, credits}, ...]
+        in ascending id order, until it returns nothing. Returns the number appended."""
+        appended = 0
+        with self._lock, self._file_lock():
+            self.refresh()
+            while True:
+                last = self._last()
+                rows = rows_after(int(last["seq"]) if last is not None else 0)
+                if not rows:
+                    return appended
+                self._append(rows, int(last["ts_ms"]) if last is not None else None)
+                self.refresh()
+                appended += len(rows)
+
+    def _last(self):
+        if not self._count:
+            return None
+        segment, offset = divmod(self._count - 1, SEGMENT_RECORDS)
+        return self._segments[segment][offset]
+
+    def _append(self, rows, last_ts):
+        timestamps = []
+        for row in rows:
+            ts = parse_timestamp_ms(row["timestamp"])
+            last_ts = ts if last_ts is None else max(ts, last_ts)
+            timestamps.append(last_ts)
+        activities = [self._encode(row["activity"]) for row in rows]
+        records = np.zeros(len(rows), dtype=RECORD)
+        records["seq"] = [row["id"] for row in rows]
+        records["ts_ms"] = timestamps
+        records["credits"] = [row["credits"] for row in rows]
+        records["length"] = [len(a) for a in activities]
+        records["activity"] = activities
+        position = self._count
+        while len(records):
+            index, offset = divmod(position, SEGMENT_RECORDS)
+            take = records[:SEGMENT_RECORDS - offset]
+            path = self._segment_path(index)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < HEADER_SIZE:
+                    os.pwrite(fd, self._header(), 0)
+                # Overwrites a torn record left by a crash mid-write, if any.
+                os.lseek(fd, HEADER_SIZE + offset * RECORD.itemsize, os.SEEK_SET)
+                os.write(fd, take.tobytes())
+                os.ftruncate(fd, HEADER_SIZE + (offset + len(take)) * RECORD.itemsize)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            position += len(take)
+            records = records[len(take):]
+
+    @staticmethod
+    def _encode(activity):
+        # Cut to the field width on a character boundary.
+        return activity.encode("utf-8")[:RECORD["activity"].itemsize].decode("utf-8", errors="ignore").encode("utf-8")
+
+    # --- reads ---
+    def page(self, start_ms=None, end_ms=None, cursor=None, limit=50, order="desc"):
+        """Entries with start_ms <= timestamp < end_ms, `limit` at a time.
+
+        `cursor` is the previous page's next_cursor (an entry id); the page continues
+        after it in `order`. total_entries and total_credits cover the whole range.
+        """
+        self.refresh()
+        with self._lock:
+            lo = self._search("ts_ms", self._sparse_ts, start_ms, "left") if start_ms is not None else 0
+            hi = self._search("ts_ms", self._sparse_ts, end_ms, "left") if end_ms is not None else self._count
+            hi = max(lo, hi)
+            total = {"total_entries": hi - lo, "total_credits": int(self._cumulative[hi] - self._cumulative[lo])}
+            if order == "desc":
+                if cursor is not None:
+                    hi = min(hi, self._search("seq", self._sparse_seq, cursor, "left"))
+                first, last = max(lo, hi - limit), hi
+            else:
+                if cursor is not None:
+                    lo = max(lo, self._search("seq", self._sparse_seq, cursor, "right"))
+                first, last = lo, min(hi, lo + limit)
+            if first >= last:
+                return {"entries": [], "next_cursor": None, **total}
+            rows = self._rows(first, last)
+            more = first > lo if order == "desc" else last < hi
+        if order == "desc":
+            rows.reverse()
+        return {"entries": rows, "next_cursor": rows[-1]["id"] if more else None, **total}
+
+    def _rows(self, lo, hi):
+        columns = {name: self._column(name, lo, hi).tolist() for name in RECORD.names}
+        return [
+            {"id": seq, "timestamp": format_timestamp(ts), "activity": activity[:length].decode("utf-8", errors="replace"), "credits": credits}
+            for seq, ts, credits, length, activity in zip(*(columns[name] for name in RECORD.names))
+        ]
+
+    def rollup(self, period, start_ms=None, end_ms=None):
+        self.refresh()
+        with self._lock:
+            return self.rollups[period].query(start_ms, end_ms)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": self._count, "segments": len(self._segments), "credits": int(self._cumulative[self._count])}
+
+
+class _FileLock:
+    """Exclusive flock on `path` for the duration of a with block; serializes writers across processes."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
@@ -0,0 +1,319 @@
+import asyncio
+import base64
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com"
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def llm_deadline(seconds):
+    """Bounds every gateway call made inside the block, retries included, to `seconds` from now.
+
+    Nested blocks can only shorten the deadline, never extend it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class LLMError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class DeadlineExceeded(LLMError):
+    pass
+
+
+class TokenBucket:
+    """`rate` requests per second with bursts of up to `burst`; only touched from the gateway loop."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self, deadline):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                raise DeadlineExceeded("Deadline would pass while waiting for the rate limiter")
+            await asyncio.sleep(wait)
+
+
+def user_content(*parts):
+    """One user turn from strings and {"mime_type", "data"} blobs (the google-generativeai shape)."""
+    converted = []
+    for part in parts:
+        if isinstance(part, str):
+            converted.append({"text": part})
+        else:
+            data = part["data"]
+            if isinstance(data, bytes):
+                data = base64.b64encode(data).decode()
+            converted.append({"inline_data": {"mime_type": part["mime_type"], "data": data}})
+    return {"role": "user", "parts": converted}
+
+
+def request_body(contents, system=None, generation_config=None):
+    body = {"contents": contents}
+    if system:
+        body["systemInstruction"] = {"parts": [{"text": system}]}
+    if generation_config:
+        body["generationConfig"] = generation_config
+    return body
+
+
+def response_text(payload):
+    candidates = payload.get("candidates") or []
+    if not candidates:
+        raise LLMError(f"No candidates returned: {payload.get('promptFeedback', payload)}")
+    return "".join(part.get("text", "") for part in candidates[0].get("content", {}).get("parts", []))
+
+
+class LLMGateway:
+    """The one path to Gemini for the API, waste.py and chatbot-bharat.py.
+
+    Calls run on a private event loop thread that owns a pooled httpx client, so async
+    endpoints, worker threads and scripts all share the same connections and limits:
+    - at most `max_concurrency` requests in flight per model (semaphore),
+    - a per-model token bucket of `rate_per_sec` with bursts of `burst`,
+    - retries on 408/429/5xx and transport errors with full-jitter exponential backoff,
+      honouring Retry-After,
+    - a deadline (llm_deadline() or `default_deadline`) that bounds each attempt's
+      timeout, the rate-limit wait and whether another retry is worth starting,
+    - singleflight: identical concurrent requests share one upstream call.
+
+    `base_url` can point at a local stub (llm_stub.py) to exercise all of this offline.
+    """
+
+    def __init__(self, api_key, base_url=GEMINI_API_BASE, max_concurrency=8, rate_per_sec=5.0, burst=10,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, attempt_timeout=30.0, default_deadline=60.0,
+                 max_connections=32):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.attempt_timeout = attempt_timeout
+        self.default_deadline = default_deadline
+        self.max_connections = max_connections
+        self.counters = {"requests": 0, "upstream_calls": 0, "coalesced": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0}
+        self._loop = None
+        self._client = None
+        self._start_lock = threading.Lock()
+        # Below are only touched from the gateway loop.
+        self._semaphores = {}
+        self._buckets = {}
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls, api_key):
+        return cls(
+            api_key,
+            base_url=os.getenv("GEMINI_API_BASE", GEMINI_API_BASE),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            rate_per_sec=float(os.getenv("LLM_RATE_PER_SEC", "5")),
+            burst=int(os.getenv("LLM_BURST", "10")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "30")),
+            default_deadline=float(os.getenv("LLM_DEADLINE_SECONDS", "60")),
+        )
+
+    # --- loop management ---
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+                self._client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers={"x-goog-api-key": self.api_key or ""},
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                )
+                self._loop = loop
+        return self._loop
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def close(self):
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+
+    def stats(self):
+        return {**self.counters, "inflight": len(self._inflight)}
+
+    # --- caller-side API ---
+    def _resolve_deadline(self, deadline):
+        return deadline or _deadline.get() or time.monotonic() + self.default_deadline
+
+    async def generate(self, model, contents, system=None, generation_config=None, deadline=None):
+        """Text of the first candidate. `contents` is Gemini's list of {"role", "parts"} turns."""
+        body = request_body(contents, system, generation_config)
+        return await asyncio.wrap_future(self._submit(self._generate(_model_name(model), body, self._resolve_deadline(deadline))))
+
+    def generate_sync(self, model, contents, system=None, generation_config=None, deadline=None):
+        """Blocking generate() for threads and scripts; never call it from the gateway loop itself."""
+        body = request_body(contents, system, generation_config)
+        return self._submit(self._generate(_model_name(model), body, self._resolve_deadline(deadline))).result()
+
+    async def stream(self, model, contents, system=None, generation_config=None, deadline=None):
+        """Yields text chunks as they arrive. Streams are never coalesced, and are only
+        retried before the first chunk."""
+        body = request_body(contents, system, generation_config)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        future = self._submit(self._stream(_model_name(model), body, self._resolve_deadline(deadline),
+                                           lambda item: loop.call_soon_threadsafe(queue.put_nowait, item)))
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            # Closing the generator early (client gone) cancels the upstream request.
+            future.cancel()
+
+    # --- gateway loop ---
+    def _limits(self, model):
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.max_concurrency)
+            self._buckets[model] = TokenBucket(self.rate_per_sec, self.burst)
+        return self._semaphores[model], self._buckets[model]
+
+    def _timeout(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline passed before the request was sent")
+        return min(self.attempt_timeout, remaining)
+
+    async def _generate(self, model, body, deadline):
+        self.counters["requests"] += 1
+        key = hashlib.sha256(json.dumps([model, body], sort_keys=True).encode()).hexdigest()
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = self._inflight[key] = asyncio.ensure_future(self._with_retries(model, body, deadline, self._post))
+            flight.add_done_callback(lambda f: self._finish_flight(key, f))
+        else:
+            self.counters["coalesced"] += 1
+        try:
+            # Shielded: a waiter timing out or being cancelled leaves the shared call running.
+            return await asyncio.wait_for(asyncio.shield(flight), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self.counters["deadline_exceeded"] += 1
+            raise DeadlineExceeded("Deadline passed while waiting for the model") from None
+
+    def _finish_flight(self, key, flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not flight.cancelled() and flight.exception() is not None:
+            self.counters["failures"] += 1
+
+    async def _post(self, model, body, deadline):
+        response = await self._client.post(f"/v1beta/models/{model}:generateContent", json=body, timeout=self._timeout(deadline))
+        if response.status_code != 200:
+            return response
+        return response_text(response.json())
+
+    async def _stream(self, model, body, deadline, put):
+        started = False
+
+        async def open_stream(model, body, deadline):
+            nonlocal started
+            request = self._client.build_request("POST", f"/v1beta/models/{model}:streamGenerateContent", params={"alt": "sse"},
+                                                 json=body, timeout=self._timeout(deadline))
+            response = await self._client.send(request, stream=True)
+            try:
+                if response.status_code != 200:
+                    await response.aread()
+                    return response
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        started = True
+                        put(("chunk", response_text(json.loads(line[5:]))))
+            finally:
+                await response.aclose()
+            return None
+
+        self.counters["requests"] += 1
+        try:
+            await self._with_retries(model, body, deadline, open_stream, retry_while=lambda: not started)
+            put(("done", None))
+        except Exception as e:
+            self.counters["failures"] += 1
+            put(("error", e))
+
+    async def _with_retries(self, model, body, deadline, attempt, retry_while=lambda: True):
+        """Runs `attempt` until it returns something other than an httpx.Response; a returned
+        response is an upstream error, retried if its status is retryable."""
+        semaphore, bucket = self._limits(model)
+        for n in range(self.max_retries + 1):
+            retry_after = 0.0
+            await bucket.acquire(deadline)
+            async with semaphore:
+                self.counters["upstream_calls"] += 1
+                try:
+                    result = await attempt(model, body, deadline)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    error = LLMError(f"{type(e).__name__}: {e}")
+                else:
+                    if not isinstance(result, httpx.Response):
+                        return result
+                    error = LLMError(f"Gemini returned {result.status_code}: {result.text[:200]}", result.status_code)
+                    if result.status_code not in RETRYABLE_STATUS:
+                        raise error
+                    retry_after = _retry_after(result)
+            if n == self.max_retries or not retry_while():
+                raise error
+            delay = max(retry_after, random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** n)))
+            if time.monotonic() + delay >= deadline:
+                self.counters["deadline_exceeded"] += 1
+                raise DeadlineExceeded(f"No time left to retry after: {error}", error.status) from error
+            self.counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+
+def _model_name(model):
+    return model.removeprefix("models/")
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
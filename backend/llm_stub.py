@@ -0,0 +1,139 @@
+"""Local stand-in for the Gemini REST API, for exercising LLMGateway without a network.
+
+    python llm_stub.py --port 8089 --latency-ms 200 --fail-rate 0.1
+    GEMINI_API_BASE=http://127.0.0.1:8089 uvicorn main:app
+
+Serves generateContent and streamGenerateContent?alt=sse for any model. The reply
+echoes the prompt. --fail-rate answers that fraction of calls with 503, and
+--max-rps answers calls above that rate with 429. GET /stats returns call counts.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PATH = re.compile(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)")
+
+
+class StubState:
+    def __init__(self, latency_ms=0, fail_rate=0.0, max_rps=None):
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.max_rps = max_rps
+        self.counts = {"calls": 0, "streams": 0, "rate_limited": 0, "failed": 0, "max_concurrent": 0}
+        self._concurrent = 0
+        self._window = []
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """None to serve the call, else the error status to answer with."""
+        with self._lock:
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 1.0]
+            if self.max_rps is not None and len(self._window) >= self.max_rps:
+                self.counts["rate_limited"] += 1
+                return 429
+            self._window.append(now)
+            if random.random() < self.fail_rate:
+                self.counts["failed"] += 1
+                return 503
+            self.counts["calls"] += 1
+            self._concurrent += 1
+            self.counts["max_concurrent"] = max(self.counts["max_concurrent"], self._concurrent)
+            return None
+
+    def release(self):
+        with self._lock:
+            self._concurrent -= 1
+
+
+def reply_text(model, body):
+    prompt = " ".join(part.get("text", "[blob]") for content in body.get("contents", []) for part in content.get("parts", []))
+    if body.get("generationConfig", {}).get("responseMimeType") == "application/json":
+        schema = body["generationConfig"].get("responseSchema", {})
+        return json.dumps({name: (spec.get("enum") or ["stub"])[0] for name, spec in schema.get("properties", {}).items()})
+    return f"[{model}] {prompt[:200]}"
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, headers=()):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, state.counts)
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            match = _PATH.match(self.path)
+            if not match:
+                return self._send(404, {"error": {"code": 404, "message": "unknown method"}})
+            status = state.admit()
+            if status is not None:
+                return self._send(status, {"error": {"code": status, "message": "stub error"}}, [("Retry-After", "0.1")] if status == 429 else ())
+            try:
+                time.sleep(state.latency)
+                model, method = match.groups()
+                text = reply_text(model, body)
+                if method == "generateContent":
+                    return self._send(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]})
+                state.counts["streams"] += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for word in re.findall(r"\S+\s*", text):
+                    chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": word}]}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+                    self.wfile.flush()
+                self.close_connection = True
+            finally:
+                state.release()
+
+    return Handler
+
+
+def serve(port=8089, latency_ms=0, fail_rate=0.0, max_rps=None):
+    """Starts the stub on a daemon thread; returns (server, state). Port 0 picks a free one."""
+    state = StubState(latency_ms, fail_rate, max_rps)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=float)
+    args = parser.parse_args()
+    server, _ = serve(args.port, args.latency_ms, args.fail_rate, args.max_rps)
+    print(f"Gemini stub listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,288 @@
+import time
+PROCESS_STARTED = time.perf_counter()  # taken before the other imports so the startup target covers them
+
 import os
-import io
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import re
+import math
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import Literal
 from dotenv import load_dotenv
-from datetime import datetime
 from PIL import Image
 
-# --- IMPORTS FOR ALL AI FEATURES ---
-import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
-import google.generativeai as genai
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema.runnable import RunnableMap, RunnablePassthrough
+# Heavy AI imports (torch, transformers, langchain) are deferred to
+# the background loaders below so the API can serve non-AI endpoints immediately.
+from inference import CaptionBatcher, make_caption_engine, shared_caption_engine
+from caption_server import RemoteCaptionBatcher
+from scan_cache import ScanCache, perceptual_hash
+from ingest import BodyLimit, read_upload, decode_image, encode_jpeg
+from storage import FarmStore, SessionTable
+from ledger import CarbonLedger
+from sensor_store import ROLLUPS, SensorStore
+from rules import RuleEngine
+from carbon_engine import compute_chunks, file_format, read_chunks
+from semantic_cache import SemanticCache
+from waste_local import LocalWasteClassifier
+from waste_llm import WasteLabeler
+from conversation import SUMMARY_PROMPT, ConversationMemory, PromptTooLong
+from llm_gateway import LLMGateway, llm_deadline, user_content
+from metrics import REGISTRY, SlowRequestProfiler, stage
 
 # --- LOAD ENVIRONMENT & CONFIGURE ---
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_API_KEY")
 if not API_KEY:
     raise ValueError("Google API Key not found. Please set it in the .env file.")
-genai.configure(api_key=API_KEY)
-app = FastAPI()
+
+CAPTION_MAX_BATCH = int(os.getenv("CAPTION_MAX_BATCH", "8"))
+CAPTION_MAX_WAIT_MS = float(os.getenv("CAPTION_MAX_WAIT_MS", "20"))
+# Set (by serve.py --mode caption-server, or by hand) to caption on a shared caption_server.py process.
+CAPTION_SERVER_SOCKET = os.getenv("CAPTION_SERVER_SOCKET")
+SCAN_CACHE_DIR = os.getenv("SCAN_CACHE_DIR")  # unset keeps scan results in memory only
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "10")) * 1024 * 1024
+CAPTION_IMAGE_SIDE = int(os.getenv("CAPTION_IMAGE_SIDE", "384"))  # BLIP's input resolution
+PEST_IMAGE_SIDE = int(os.getenv("PEST_IMAGE_SIDE", "768"))
+PEST_JPEG_QUALITY = int(os.getenv("PEST_JPEG_QUALITY", "85"))
+# Bulk carbon rosters are streamed from the spooled upload, so they may be much larger.
+CARBON_MAX_UPLOAD_BYTES = int(os.getenv("CARBON_MAX_UPLOAD_MB", "512")) * 1024 * 1024
+CARBON_CHUNK_ROWS = int(os.getenv("CARBON_CHUNK_ROWS", "100000"))
+# Per-request budget for all Gemini calls of one endpoint, retries included.
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+# Opt-in: requests slower than this many ms get their sampled stacks written to PROFILE_DIR.
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+# Time from process start until the API accepts requests; exceeding it is logged.
+STARTUP_TARGET_SECONDS = float(os.getenv("STARTUP_TARGET_SECONDS", "2.0"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    caption_batcher.start()
+    startup_timings["serving_after_s"] = round(time.perf_counter() - PROCESS_STARTED, 3)
+    if startup_timings["serving_after_s"] > STARTUP_TARGET_SECONDS:
+        print(f"Startup took {startup_timings['serving_after_s']}s, above the {STARTUP_TARGET_SECONDS}s target.")
+    warm_up_task = asyncio.create_task(warm_up_models())
+    yield
+    warm_up_task.cancel()
+    caption_batcher.stop()
+    llm_gateway.close()
+    if waste_local is not None and waste_local.dirty:
+        waste_local.save(WASTE_LOCAL_MODEL)
+
+app = FastAPI(lifespan=lifespan)
+# Uploads are rejected on Content-Length or while streaming in, not after spooling to disk.
+app.add_middleware(BodyLimit, limits={
+    "/classify-waste": MAX_UPLOAD_BYTES,
+    "/scan-pest": MAX_UPLOAD_BYTES,
+    "/carbon-footprint/batch": CARBON_MAX_UPLOAD_BYTES,
+})
 
 # --- CORS MIDDLEWARE ---
 origins = ["*"]
 app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-# --- IN-MEMORY DATABASE ---
-fake_db = {
-    "plots": {"plot_a": {"name": "North Field", "crop": "Tomatoes", "logs": []}, "plot_b": {"name": "West Patch", "crop": "Corn", "logs": []}},
-    "missions": [{"id": "m1", "title": "Start a Compost Pile", "reward": 20, "completed": False}, {"id": "m2", "title": "Apply Neem Oil", "reward": 30, "completed": False}, {"id": "m3", "title": "Install Drip Irrigation", "reward": 50, "completed": False}, {"id": "m4", "title": "Crop Rotation Plan", "reward": 25, "completed": True}],
-    "carbon_ledger": [{"timestamp": "2024-03-10T10:00:00Z", "activity": "Completed Mission: Crop Rotation Plan", "credits": 25}],
-    "sustainability_score": 35,
-    "weather_forecast": {"condition": "High Humidity", "temperature_celsius": 28, "chance_of_rain_percent": 80}
-}
+# --- METRICS (Prometheus text on /metrics) ---
+REQUEST_SECONDS = REGISTRY.histogram("agrosage_http_request_seconds", "Time to response headers per route.", ("method", "route", "status"))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("agrosage_http_requests_in_flight", "Requests currently being handled.")
+profiler = SlowRequestProfiler(PROFILE_SLOW_MS, out_dir=os.getenv("PROFILE_DIR", "profiles")) if PROFILE_SLOW_MS > 0 else None
+
+def route_of(request):
+    route = request.scope.get("route")
+    return route.path if route else "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        if profiler is None:
+            response = await call_next(request)
+        else:
+            with profiler.track(lambda: f"{request.method} {route_of(request)}"):
+                response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route_of(request), status=status)
+
+# --- DATABASE (SQLite in WAL mode, shared by all worker processes) ---
+store = FarmStore(os.getenv("AGROSAGE_DB", "agrosage.db"), pool_size=int(os.getenv("AGROSAGE_DB_POOL", "4")))
+# Carbon ledger history and rollups: an append-only, memory-mapped copy of the SQLite ledger.
+ledger = CarbonLedger(
+    os.getenv("LEDGER_DIR", "ledger"),
+    source_id=store.instance_id,
+    utc_offset_minutes=int(os.getenv("LEDGER_UTC_OFFSET_MINUTES", "330")),
+    fsync=os.getenv("LEDGER_FSYNC", "0") == "1",
+)
+ledger.verify(store.ledger_entry)  # rebuilt from scratch if agrosage.db was replaced or reset
+ledger.sync(store.ledger_entries_after)
+# High-rate soil-moisture readings live in fixed-size per-plot ring buffers with rollups.
+sensors = SensorStore(capacity=int(os.getenv("SENSOR_RING_CAPACITY", "100000")))
+# Dashboard recommendations: declarative rules over columnar plot data, re-evaluated
+# only when the weather, plot list or a plot's latest reading changes.
+rule_engine = RuleEngine(top_n=int(os.getenv("RECOMMENDATIONS_TOP_N", "4")))
+rule_engine.set_weather(store.weather_forecast())
+rule_engine.set_plots(store.plots())
+for plot_id, moisture in store.latest_soil_moisture().items():
+    rule_engine.update_sensor(plot_id, moisture)
 
 
 # ==============================================================================
-# --- AI MODEL INITIALIZATION (Happens once on startup) ---
+# --- AI MODEL INITIALIZATION (Runs in the background after startup) ---
 # ==============================================================================
-print("Loading all AI models... This may take a moment on the first run.")
+# "llm" covers the Gemini chat chains and pest vision model, "blip" the local captioner.
+readiness = {"llm": "pending", "blip": "pending"}
+startup_timings = {"serving_after_s": None, "llm_ready_after_s": None, "blip_ready_after_s": None, "target_s": STARTUP_TARGET_SECONDS}
+
+# Every Gemini call (chains, streaming, pest vision) shares this gateway's connection
+# pool, per-model concurrency and rate limits, retries and request coalescing.
+llm_gateway = LLMGateway.from_env(API_KEY)
+PEST_VISION_MODEL = "gemini-1.5-flash"
+
+llm_chat = None
+chatbot_chain = None
+caption_engine = None
+
+
+def load_llm_chains():
+    global llm_chat, chatbot_chain
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.output_parsers import StrOutputParser
+    from gateway_chat import GatewayChatModel
+
+    # --- Models for AgroSage Features (EcoBot, waste labels); pest vision calls the gateway directly ---
+    llm_chat = GatewayChatModel(gateway=llm_gateway, model="gemini-1.5-flash")
+
+    # The system prompt stays first and unchanged so every request of a session shares its prefix.
+    eco_prompt_chat = ChatPromptTemplate.from_messages([
+        ("system", ECOBOT_SYSTEM_PROMPT),
+        MessagesPlaceholder("history", optional=True),
+        ("human", "{input}")
+    ])
+    chatbot_chain = eco_prompt_chat | llm_chat | StrOutputParser()
+    conversations.summarizer = ChatPromptTemplate.from_template(SUMMARY_PROMPT) | llm_chat | StrOutputParser()
 
-# --- Models for AgroSage Features (Pest Scan, EcoBot) ---
-llm_chat = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=API_KEY)
-llm_vision_pest = genai.GenerativeModel('gemini-1.5-flash')
+    # LangChain setup for waste classification
+    prompt_classify_waste = ChatPromptTemplate.from_template("Analyze: '{caption}'. Classify the waste type (Biodegradable, Non-biodegradable, Recyclable, Medical, Electronic). Respond with only the lowercase waste type.")
+    prompt_bin = ChatPromptTemplate.from_template("Item: '{caption}'. Based on Indian norms, what dustbin color? (green, blue, red, yellow, black, or special sanitary rule). Respond with only the color/rule.")
+    prompt_explain = ChatPromptTemplate.from_template("Explain in one line why an item described as '{caption}' should go into its designated bin color (Green: Wet, Blue: Dry, Red/Yellow: Medical, Black: E-waste).")
+
+    waste_labeler.attach(llm_chat, prompt_classify_waste, prompt_bin, prompt_explain)
+
+
+def load_captioner():
+    global caption_engine
+    if CAPTION_SERVER_SOCKET:
+        caption_batcher.wait_ready()
+        return
+    # --- Models for Waste Classification Feature ---
+    # CAPTION_ENGINE picks eager torch (default), int8 dynamic quantization or ONNX Runtime.
+    # This will download the model from Hugging Face the first time you run the server.
+    # Workers forked by serve.py --mode prefork reuse the master's copy of the weights.
+    caption_engine = shared_caption_engine() or make_caption_engine().load()
+    # Warm-up pass so the first real upload doesn't pay for lazy kernel/allocator setup.
+    caption_engine.caption_batch([Image.new("RGB", (384, 384), "white")])
+
+
+def caption_images(images):
+    return caption_engine.caption_batch(images)
+
+
+async def warm_up_models():
+    print("Loading all AI models in the background... This may take a moment on the first run.")
+    for component, loader in (("llm", load_llm_chains), ("blip", load_captioner)):
+        readiness[component] = "loading"
+        try:
+            await asyncio.to_thread(loader)
+        except Exception as e:
+            readiness[component] = f"failed: {e}"
+            print(f"Error loading {component}: {e}")
+            continue
+        readiness[component] = "ready"
+        startup_timings[f"{component}_ready_after_s"] = round(time.perf_counter() - PROCESS_STARTED, 3)
+    print("AI model warm-up finished:", readiness)
+
+
+def require_ready(*components):
+    pending = {c: readiness[c] for c in components if readiness[c] != "ready"}
+    if pending:
+        raise HTTPException(status_code=503, detail=f"Models not ready: {pending}", headers={"Retry-After": "5"})
+
+
+# Concurrent uploads share one generate call; the worker thread keeps the event loop free.
+# With a caption server, the batching happens there, across all API workers.
+if CAPTION_SERVER_SOCKET:
+    caption_batcher = RemoteCaptionBatcher(CAPTION_SERVER_SOCKET)
+else:
+    caption_batcher = CaptionBatcher(caption_images, max_batch_size=CAPTION_MAX_BATCH, max_wait_ms=CAPTION_MAX_WAIT_MS)
+
+# Most farmer questions are rephrasings of a few hundred common ones.
+ECOBOT_CACHE_ENABLED = os.getenv("ECOBOT_CACHE", "1") != "0"
+ecobot_cache = SemanticCache(
+    capacity=int(os.getenv("ECOBOT_CACHE_SIZE", "2048")),
+    ttl_seconds=int(os.getenv("ECOBOT_CACHE_TTL_SECONDS", "21600")),
+    threshold=float(os.getenv("ECOBOT_CACHE_SIMILARITY", "0.85")),
+)
+
+# EcoBot sessions: recent turns plus a rolling summary, within a hard per-request token budget.
+ECOBOT_SYSTEM_PROMPT = "You are EcoBot, a helpful assistant for Indian sustainable farming. Provide concise, actionable advice."
+conversations = ConversationMemory(
+    ECOBOT_SYSTEM_PROMPT,
+    budget_tokens=int(os.getenv("ECOBOT_CONTEXT_TOKENS", "2000")),
+    summary_tokens=int(os.getenv("ECOBOT_SUMMARY_TOKENS", "300")),
+    # In SQLite, so a follow-up finds its conversation whichever worker it lands on.
+    sessions=SessionTable(store.pool, capacity=int(os.getenv("ECOBOT_SESSIONS", "50000")), ttl_seconds=int(os.getenv("ECOBOT_SESSION_TTL_SECONDS", "86400"))),
+)
+
+# Session reads and writes are SQLite calls that can wait on the write lock, so they run off the event loop.
+async def ecobot_inputs(query):
+    """Chain inputs with the session's history; 413 when the question alone is over the budget."""
+    try:
+        return {"input": query.query, "history": await asyncio.to_thread(conversations.history, query.session_id, query.query)}
+    except PromptTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-eco_prompt_chat = ChatPromptTemplate.from_messages([
-    ("system", "You are EcoBot, a helpful assistant for Indian sustainable farming. Provide concise, actionable advice."),
-    ("human", "{input}")
-])
-chatbot_chain = eco_prompt_chat | llm_chat | StrOutputParser()
+async def remember_turn(query, answer):
+    if query.session_id and await asyncio.to_thread(conversations.record, query.session_id, query.query, answer):
+        conversations.compact_in_background(query.session_id)
 
+async def ecobot_bypass_cache(query):
+    # A follow-up only makes sense with its conversation, so just a session's first question may hit the cache.
+    if query.bypass_cache or not ECOBOT_CACHE_ENABLED:
+        return True
+    return query.session_id is not None and not await asyncio.to_thread(conversations.is_empty, query.session_id)
 
-# --- Models for Waste Classification Feature ---
-# This will download the model from Hugging Face the first time you run the server.
-caption_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-caption_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+# Common captions are labelled locally (learned Gemini answers, keywords, naive Bayes);
+# only the rest go to the LLM. Learned state is saved to WASTE_LOCAL_MODEL on shutdown.
+WASTE_LOCAL_MODEL = os.getenv("WASTE_LOCAL_MODEL", "waste_local.json")
+waste_local = LocalWasteClassifier.from_env() if os.getenv("WASTE_LOCAL", "1") != "0" else None
+# WASTE_LLM_MODE picks serial, parallel (default) or a single structured call; Gemini is attached once loaded.
+waste_labeler = WasteLabeler(local=waste_local)
 
-# LangChain setup for waste classification
-prompt_classify_waste = ChatPromptTemplate.from_template("Analyze: '{caption}'. Classify the waste type (Biodegradable, Non-biodegradable, Recyclable, Medical, Electronic). Respond with only the lowercase waste type.")
-prompt_bin = ChatPromptTemplate.from_template("Item: '{caption}'. Based on Indian norms, what dustbin color? (green, blue, red, yellow, black, or special sanitary rule). Respond with only the color/rule.")
-prompt_explain = ChatPromptTemplate.from_template("Explain in one line why an item described as '{caption}' should go into its designated bin color (Green: Wet, Blue: Dry, Red/Yellow: Medical, Black: E-waste).")
+# --- Scan result caches (exact upload hash, then perceptual near-duplicate match) ---
+def make_scan_cache(name):
+    return ScanCache(
+        name,
+        max_entries=int(os.getenv("SCAN_CACHE_MAX_ENTRIES", "2048")),
+        max_bytes=int(os.getenv("SCAN_CACHE_MAX_MB", "32")) * 1024 * 1024,
+        ttl_seconds=int(os.getenv("SCAN_CACHE_TTL_SECONDS", "86400")),
+        max_distance=int(os.getenv("SCAN_CACHE_HAMMING", "4")),
+        disk_dir=SCAN_CACHE_DIR,
+    )
 
-chain_classify_waste = prompt_classify_waste | llm_chat | StrOutputParser()
-chain_bin = prompt_bin | llm_chat | StrOutputParser()
-chain_explain = prompt_explain | llm_chat | StrOutputParser()
-print("All AI models loaded successfully.")
+waste_cache = make_scan_cache("waste")
+pest_cache = make_scan_cache("pest")
 # ==============================================================================
 
 
 # --- PYDANTIC MODELS (Data Structure Definitions) ---
-class ChatQuery(BaseModel): query: str
+class ChatQuery(BaseModel): query: str; bypass_cache: bool = False; session_id: str | None = None
 class PlotLog(BaseModel): plot_id: str; soil_moisture: float; pest_sighting: str | None = None
 class WasteClassificationResponse(BaseModel): caption: str; category: str; bin_color: str; explanation: str
 
@@ -89,26 +299,37 @@ def read_root(): return {"message": "AgroSage Super-App API is Live"}
 async def classify_waste(file: UploadFile = File(...)):
     """Takes an image, generates a caption, and classifies the waste."""
     try:
-        contents = await file.read()
-        # Use a copy of the bytes for the image to avoid issues with file pointers
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-
-        # 1. Generate Caption using local BLIP model
-        inputs = caption_processor(image, return_tensors="pt")
-        out = caption_model.generate(**inputs, max_new_tokens=50)
-        caption = caption_processor.decode(out[0], skip_special_tokens=True).strip()
-
-        # 2. Use LangChain and Gemini to get structured data
-        category = chain_classify_waste.invoke({"caption": caption}).strip()
-        bin_color = chain_bin.invoke({"caption": caption}).strip()
-        explanation = chain_explain.invoke({"caption": caption}).strip()
-
-        return WasteClassificationResponse(
-            caption=caption,
-            category=category,
-            bin_color=bin_color,
-            explanation=explanation
-        )
+        with stage("upload_read"):
+            key = await read_upload(file, MAX_UPLOAD_BYTES)
+        cached = waste_cache.get_exact(key)
+        if cached:
+            return WasteClassificationResponse(**cached)
+        # Decoded at reduced size: BLIP only ever sees CAPTION_IMAGE_SIDE pixels.
+        with stage("decode"):
+            image = decode_image(file.file, CAPTION_IMAGE_SIDE)
+        with stage("phash"):
+            phash = perceptual_hash(image)
+        cached = waste_cache.get_near(phash)
+        if cached:
+            waste_cache.put(key, phash, cached)
+            return WasteClassificationResponse(**cached)
+
+        require_ready("blip")
+        # 1. Generate Caption using local BLIP model (batched with other in-flight uploads)
+        # Includes the wait in the batcher queue; caption_preprocess/caption_generate are the model alone.
+        with stage("caption"):
+            caption = await caption_batcher.caption(image)
+
+        # 2. Common captions are labelled locally; the rest use LangChain and Gemini
+        # The LLM check comes after the local attempt, so these keep working while Gemini is down.
+        with llm_deadline(LLM_DEADLINE_SECONDS):
+            labels = await waste_labeler.alabel(caption, before_llm=lambda: require_ready("llm"))
+
+        result = WasteClassificationResponse(caption=caption, **labels)
+        waste_cache.put(key, phash, result.model_dump())
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error during waste classification: {e}")
         raise HTTPException(status_code=500, detail=f"Error during waste classification: {e}")
@@ -116,68 +337,293 @@ async def classify_waste(file: UploadFile = File(...)):
 # --- Existing AgroSage Endpoints ---
 @app.post("/scan-pest")
 async def scan_pest(file: UploadFile = File(...)):
-    contents = await file.read()
-    image = Image.open(io.BytesIO(contents)).convert("RGB")
+    with stage("upload_read"):
+        key = await read_upload(file, MAX_UPLOAD_BYTES)
+    cached = pest_cache.get_exact(key)
+    if cached:
+        return cached
+    with stage("decode"):
+        image = decode_image(file.file, PEST_IMAGE_SIDE)
+    with stage("phash"):
+        phash = perceptual_hash(image)
+    cached = pest_cache.get_near(phash)
+    if cached:
+        pest_cache.put(key, phash, cached)
+        return cached
+    require_ready("llm")
     prompt = "Analyze this plant leaf. 1. Identify pest/disease. If healthy, say so. 2. Provide a brief, organic solution. Format: 'Diagnosis: [Your Diagnosis].\nSolution: [Your Solution].'"
     try:
-        response = llm_vision_pest.generate_content([prompt, image])
-        return {"result": response.text}
+        # A compact JPEG instead of the raw upload keeps the Gemini payload small.
+        with stage("pest_encode"):
+            payload = {"mime_type": "image/jpeg", "data": encode_jpeg(image, PEST_JPEG_QUALITY)}
+        with llm_deadline(LLM_DEADLINE_SECONDS), stage("pest_vision"):
+            result = {"result": await llm_gateway.generate(PEST_VISION_MODEL, [user_content(prompt, payload)])}
+        pest_cache.put(key, phash, result)
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches `etag`, compared weakly as RFC 9110 requires.
+
+    The header may be `*`, or a comma-separated list of tags with or without `W/`.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in re.findall(r'(?:W/)?("[^"]*")', if_none_match)
+
 @app.get("/dashboard-data")
-def get_dashboard_data():
-    return {
-        "sustainability_score": fake_db["sustainability_score"],
-        "active_missions": len([m for m in fake_db["missions"] if not m["completed"]]),
-        "carbon_credits": sum(entry['credits'] for entry in fake_db['carbon_ledger']),
-        "recommendations": generate_recommendations()
-    }
+def get_dashboard_data(request: Request):
+    totals = store.dashboard_totals()
+    recommendations, digest = rule_engine.snapshot()
+    # Recommendations come from each worker's own rule engine, so their part is a content hash, not a counter.
+    etag = f'W/"dashboard-{totals.pop("version")}-{digest}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(content={**totals, "recommendations": recommendations}, headers={"ETag": etag})
+
+@app.get("/ready")
+def get_readiness():
+    """Readiness probe: 503 until every model is loaded and warmed up. `/` stays the liveness check."""
+    ready = all(state == "ready" for state in readiness.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "components": readiness, "startup": startup_timings})
+
+@REGISTRY.collector
+def collect_runtime_metrics():
+    samples = [
+        ("agrosage_caption_queue_depth", "gauge", "Images waiting for the caption batcher.", {}, caption_batcher.queue_depth),
+        ("agrosage_model_ready", "gauge", "1 once the component's models are loaded.", {"component": "llm"}, int(readiness["llm"] == "ready")),
+        ("agrosage_model_ready", "gauge", "1 once the component's models are loaded.", {"component": "blip"}, int(readiness["blip"] == "ready")),
+    ]
+    for name, cache in (("waste", waste_cache), ("pest", pest_cache), ("ecobot", ecobot_cache)):
+        stats = cache.stats()
+        samples += [("agrosage_cache_lookups_total", "counter", "Cache lookups by outcome.", {"cache": name, "outcome": outcome}, stats[outcome])
+                    for outcome in ("exact_hits", "near_hits", "semantic_hits", "disk_hits", "misses") if outcome in stats]
+        samples.append(("agrosage_cache_entries", "gauge", "Entries held in memory.", {"cache": name}, stats["entries"]))
+    gateway = llm_gateway.stats()
+    if waste_local is not None:
+        local = waste_local.stats()
+        samples += [("agrosage_waste_labels_total", "counter", "Waste captions labelled, by source (memory, keywords and model are local).", {"source": source}, local[source])
+                    for source in ("memory", "keywords", "model", "llm")]
+    sessions = conversations.stats()
+    samples.append(("agrosage_ecobot_sessions", "gauge", "EcoBot conversations stored.", {}, sessions["sessions"]))
+    samples += [("agrosage_ecobot_session_events_total", "counter", "EcoBot turns, summary compactions and evictions.", {"event": event}, sessions[event])
+                for event in ("turns", "compactions", "compaction_failures", "turns_dropped", "evicted", "expired")]
+    samples.append(("agrosage_ledger_entries", "gauge", "Carbon ledger entries mapped by this worker.", {}, ledger.stats()["entries"]))
+    samples.append(("agrosage_llm_inflight", "gauge", "Distinct upstream LLM calls in flight.", {}, gateway.pop("inflight")))
+    samples += [("agrosage_llm_events_total", "counter", "LLM gateway requests, upstream calls, coalesced waits, retries, failures.", {"event": event}, count)
+                for event, count in gateway.items()]
+    return samples
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache-stats")
+def get_cache_stats():
+    return {"waste": waste_cache.stats(), "pest": pest_cache.stats(), "ecobot": ecobot_cache.stats(), "ecobot_sessions": conversations.stats(), "llm_gateway": llm_gateway.stats(),
+            "waste_local": waste_local.stats() if waste_local is not None else None}
 
 @app.get("/missions")
-def get_missions(): return fake_db["missions"]
+def get_missions(): return store.missions()
 
 @app.post("/ask-ecobot")
-async def ask_bot(request: ChatQuery):
+async def ask_bot(request: ChatQuery, response: Response):
+    started = time.perf_counter()
+    cached = ecobot_cache.get(request.query, bypass=await ecobot_bypass_cache(request))
+    if cached is not None:
+        await remember_turn(request, cached)
+        response.headers["X-Response-Time-Ms"] = f"{(time.perf_counter() - started) * 1000:.1f}"
+        return {"response": cached}
+    require_ready("llm")
+    inputs = await ecobot_inputs(request)
     try:
-        answer = chatbot_chain.invoke({"input": request.query})
+        with llm_deadline(LLM_DEADLINE_SECONDS), stage("llm_ecobot"):
+            answer = await chatbot_chain.ainvoke(inputs)
+        if not inputs["history"]:
+            ecobot_cache.put(request.query, answer)
+        await remember_turn(request, answer)
+        # For the blocking endpoint the first token arrives with the last one.
+        response.headers["X-Response-Time-Ms"] = f"{(time.perf_counter() - started) * 1000:.1f}"
         return {"response": answer}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {e}")
 
+def sse_event(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+@app.post("/ask-ecobot/stream")
+async def ask_bot_stream(query: ChatQuery, request: Request):
+    """Streams EcoBot tokens as Server-Sent Events, ending with a `done` event carrying timings."""
+    async def events():
+        started = time.perf_counter()
+        cached = ecobot_cache.get(query.query, bypass=await ecobot_bypass_cache(query))
+        if cached is not None:
+            await remember_turn(query, cached)
+            yield sse_event({"token": cached})
+            elapsed = round((time.perf_counter() - started) * 1000, 1)
+            yield sse_event({"ttft_ms": elapsed, "total_ms": elapsed, "cached": True}, event="done")
+            return
+        if readiness["llm"] != "ready":
+            yield sse_event({"detail": f"Models not ready: {readiness['llm']}"}, event="error")
+            return
+
+        try:
+            inputs = await ecobot_inputs(query)
+        except HTTPException as e:
+            yield sse_event({"detail": e.detail}, event="error")
+            return
+
+        ttft_ms = None
+        chunks = []
+        stream = chatbot_chain.astream(inputs)
+        try:
+            # The deadline is read when the stream starts, inside this block.
+            with llm_deadline(LLM_DEADLINE_SECONDS), stage("llm_ecobot_stream"):
+                async for chunk in stream:
+                    # Stop pulling from Gemini as soon as the client is gone; closing the
+                    # stream below cancels the upstream request.
+                    if await request.is_disconnected():
+                        return
+                    if ttft_ms is None:
+                        ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                    chunks.append(chunk)
+                    yield sse_event({"token": chunk})
+        except Exception as e:
+            yield sse_event({"detail": f"Error processing query: {e}"}, event="error")
+            return
+        finally:
+            await stream.aclose()
+
+        answer = "".join(chunks)
+        if not inputs["history"]:
+            ecobot_cache.put(query.query, answer)
+        await remember_turn(query, answer)
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        yield sse_event({"ttft_ms": ttft_ms, "total_ms": total_ms, "cached": False}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.delete("/ask-ecobot/sessions/{session_id}")
+def clear_ecobot_session(session_id: str):
+    if not conversations.clear(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Conversation cleared"}
+
 @app.post("/complete-mission/{mission_id}")
 def complete_mission(mission_id: str):
-    mission = next((m for m in fake_db["missions"] if m["id"] == mission_id), None)
-    if not mission or mission["completed"]:
+    # One transaction: concurrent completions of the same mission credit it only once.
+    entry = store.complete_mission(mission_id)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Mission not found or already completed")
-    mission["completed"] = True
-    entry = {"timestamp": datetime.now().isoformat(), "activity": f"Completed Mission: {mission['title']}", "credits": mission['reward']}
-    fake_db["carbon_ledger"].append(entry)
-    fake_db["sustainability_score"] += mission['reward']
+    ledger.sync(store.ledger_entries_after)
     return {"message": "Mission completed!", "entry": entry}
 
+@app.get("/ledger")
+def get_ledger(start_ms: int | None = None, end_ms: int | None = None, cursor: int | None = None,
+               limit: int = Query(50, ge=1, le=500), order: Literal["asc", "desc"] = "desc"):
+    """Ledger entries in [start_ms, end_ms), newest first by default. Pass the response's
+    next_cursor as `cursor` for the next page; it is null on the last one."""
+    ledger.sync(store.ledger_entries_after)  # picks up entries other workers' writes haven't synced yet
+    return ledger.page(start_ms, end_ms, cursor, limit, order)
+
+@app.get("/ledger/rollups")
+def get_ledger_rollups(period: Literal["day", "month", "season"] = "month", start_ms: int | None = None, end_ms: int | None = None):
+    """Credits and entry counts per day, month or cropping season (Kharif/Rabi/Zaid) overlapping [start_ms, end_ms)."""
+    return {"period": period, "buckets": ledger.rollup(period, start_ms, end_ms)}
+
 @app.post("/log-plot-data")
 async def log_plot_data(log: PlotLog):
-    if log.plot_id not in fake_db["plots"]:
+    if not math.isfinite(log.soil_moisture):  # JSON NaN/Infinity would poison the rollups
+        raise HTTPException(status_code=422, detail="soil_moisture must be a finite number")
+    timestamped_log = await asyncio.to_thread(store.add_plot_log, log.plot_id, log.soil_moisture, log.pest_sighting)
+    if timestamped_log is None:
         raise HTTPException(status_code=404, detail="Plot not found")
-    timestamped_log = log.model_dump()
-    timestamped_log["timestamp"] = datetime.now().isoformat()
-    fake_db["plots"][log.plot_id]["logs"].append(timestamped_log)
+    sensors.ingest(log.plot_id, [int(time.time() * 1000)], [log.soil_moisture])
+    rule_engine.update_sensor(log.plot_id, log.soil_moisture)
     return {"message": "Log received successfully, AI will now generate new recommendations."}
 
+def group_readings(body, content_type):
+    """Parses a batch body into {plot_id: (timestamps_ms, soil_moisture)}.
+
+    Accepts a JSON array of {plot_id, soil_moisture, timestamp_ms?} readings, the same
+    readings as NDJSON, or one plot's columnar arrays {plot_id, soil_moisture: [...],
+    timestamps_ms: [...]}. Missing timestamps default to the time of receipt.
+    """
+    now_ms = int(time.time() * 1000)
+    if "ndjson" in content_type:
+        rows = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            moisture = payload["soil_moisture"]
+            timestamps = payload.get("timestamps_ms") or [now_ms] * len(moisture)
+            if len(timestamps) != len(moisture):
+                raise ValueError("timestamps_ms and soil_moisture differ in length")
+            return {payload["plot_id"]: (timestamps, moisture)}
+        rows = payload
+    grouped = {}
+    for row in rows:
+        timestamps, moisture = grouped.setdefault(row["plot_id"], ([], []))
+        timestamps.append(row.get("timestamp_ms", now_ms))
+        moisture.append(row["soil_moisture"])
+    return grouped
+
+@app.post("/log-plot-data/batch")
+async def log_plot_data_batch(request: Request):
+    """Bulk sensor ingest for IoT gateways; see group_readings for the accepted formats."""
+    body = await request.body()
+    try:
+        grouped = group_readings(body, request.headers.get("content-type", ""))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=422, detail=f"Malformed readings: {e}")
+    plots = await asyncio.to_thread(store.plots)
+    unknown = sorted(set(grouped) - set(plots))
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Plot not found: {', '.join(unknown)}")
+    try:
+        sensors.ingest_many(grouped)  # validates the whole batch before storing any of it
+    except (ValueError, TypeError, OverflowError) as e:
+        raise HTTPException(status_code=422, detail=f"Malformed readings: {e}")
+    for plot_id in grouped:
+        latest = sensors.latest(plot_id)
+        if latest is not None:
+            rule_engine.update_sensor(plot_id, latest[1])
+    return {"message": "Readings received successfully.", "accepted": sum(len(m) for _, m in grouped.values())}
+
+@app.post("/carbon-footprint/batch")
+def carbon_footprint_batch(file: UploadFile = File(...)):
+    """Footprints for a roster upload (.csv or .parquet, one farm per row), streamed back as CSV."""
+    if file.size is not None and file.size > CARBON_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Roster larger than {CARBON_MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    chunks = read_chunks(file.file, file_format(file.filename or ""), CARBON_CHUNK_ROWS)
+    results = compute_chunks(chunks)
+    try:
+        # Compute the first chunk up front so bad input is a 422 rather than a truncated body.
+        first = next(results, None)
+    except (ValueError, KeyError) as e:
+        chunks.close()  # before the upload is closed, not whenever the reader is collected
+        raise HTTPException(status_code=422, detail=f"Could not compute footprints: {e}")
+    if first is None:
+        raise HTTPException(status_code=422, detail="Roster is empty")
+
+    def rows():
+        yield first.to_csv(index=False)
+        for result in results:
+            yield result.to_csv(index=False, header=False)
+
+    return StreamingResponse(rows(), media_type="text/csv", headers={"Content-Disposition": 'attachment; filename="roster_emissions.csv"'})
+
+@app.get("/plots/{plot_id}/rollups")
+def get_plot_rollups(plot_id: str, resolution: Literal["minute", "hour"] = "minute", start_ms: int | None = None, end_ms: int | None = None):
+    """min/mean/max soil moisture per bucket in [start_ms, end_ms); defaults to the whole retention window."""
+    if plot_id not in store.plots():
+        raise HTTPException(status_code=404, detail="Plot not found")
+    width, retention = ROLLUPS[resolution]
+    end_ms = end_ms if end_ms is not None else int(time.time() * 1000) + width
+    start_ms = start_ms if start_ms is not None else end_ms - width * retention
+    return {"plot_id": plot_id, "resolution": resolution, "buckets": sensors.rollups(plot_id, resolution, start_ms, end_ms)}
 
-# ==============================================================================
-# --- AI RECOMMENDATION ENGINE (for AgroSage Dashboard) ---
-# ==============================================================================
-def generate_recommendations():
-    recommendations = []
-    weather = fake_db["weather_forecast"]
-    if weather["chance_of_rain_percent"] > 70:
-        recommendations.append({"id": "weather_rain_alert", "title": "Heavy Rain Forecasted", "details": "Consider delaying irrigation to conserve water."})
-    elif weather["condition"] == "High Humidity":
-        recommendations.append({"id": "weather_humidity_alert", "title": "High Humidity Alert", "details": "Risk of fungal diseases. Ensure good air circulation."})
-    for plot_id, plot_data in fake_db["plots"].items():
-        if plot_data["crop"] == "Tomatoes" and weather["condition"] == "High Humidity":
-            recommendations.append({"id": f"{plot_id}_tomato_blight_risk", "title": f"Blight Risk for Tomatoes", "details": f"The high humidity puts your Tomatoes in {plot_data['name']} at high risk for Early Blight."})
-    unique_recs = {rec['title']: rec for rec in recommendations}.values()
-    return list(unique_recs)[:4]
\ No newline at end of file
@@ -0,0 +1,238 @@
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = self._snapshot()
+        for key, value in sorted(series.items()):
+            lines += self._render_series(key, value)
+        return lines
+
+    def _snapshot(self):
+        return dict(self._series)
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _snapshot(self):
+        return {key: (list(counts), total, n) for key, (counts, total, n) in self._series.items()}
+
+    def _render_series(self, key, value):
+        counts, total, n = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(bound))])} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        return lines + [f"{self.name}_sum{labels} {_format_value(total)}", f"{self.name}_count{labels} {n}"]
+
+
+class Registry:
+    """Metrics plus collectors that read existing counters (caches, queues) at scrape time.
+
+    A collector returns [(name, kind, help, {labels}, value), ...].
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        grouped = {}
+        for collect in self._collectors:
+            for name, kind, help, labels, value in collect():
+                grouped.setdefault((name, kind, help), []).append((labels, value))
+        for (name, kind, help), samples in grouped.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("agrosage_stage_seconds", "Latency of each pipeline stage.", ("stage",))
+
+
+@contextmanager
+def stage(name):
+    """Times the block into agrosage_stage_seconds{stage=name}, also when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+
+class SlowRequestProfiler:
+    """Opt-in sampling profiler that keeps stacks only for requests slower than `threshold_ms`.
+
+    While any request is tracked, a daemon thread samples every thread's stack each
+    `interval_ms` and tallies it into every tracked request. A request that finishes
+    above the threshold is written to `out_dir` as collapsed stacks ("a;b;c count"),
+    the input format of flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, threshold_ms, interval_ms=5.0, out_dir="profiles"):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self._samples = {}  # id -> stack tally of each request being tracked
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def track(self, label):
+        """Samples while the block runs; `label` is a zero-argument callable read at the end,
+        so it can name the route matched inside the block."""
+        samples = _Tally()
+        with self._lock:
+            self._samples[id(samples)] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                del self._samples[id(samples)]
+            if elapsed >= self.threshold and samples:
+                self._dump(label(), elapsed, samples)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                targets = list(self._samples.values())
+                if not targets:
+                    self._wake.clear()
+            if not targets:
+                self._wake.wait()
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                folded = ";".join([names.get(ident, str(ident)), *reversed(stack)])
+                for samples in targets:
+                    samples[folded] += 1
+            time.sleep(self.interval)
+
+    def _dump(self, label, elapsed, samples):
+        os.makedirs(self.out_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        path = os.path.join(self.out_dir, f"{int(time.time() * 1000)}-{slug}-{elapsed * 1000:.0f}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in samples.items():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import operator
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+OPERATORS = {"==": operator.eq, "!=": operator.ne, ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+
+@dataclass(frozen=True)
+class Condition:
+    """`field` is "weather.<key>", "plot.crop" or "plot.soil_moisture"; `op` is a comparison or "in"."""
+    field: str
+    op: str
+    value: object
+
+    @property
+    def source(self):
+        """Which input this condition reads: weather, crop or sensor."""
+        return {"plot.crop": "crop", "plot.soil_moisture": "sensor"}.get(self.field, self.field.split(".")[0])
+
+
+@dataclass(frozen=True)
+class Rule:
+    """A recommendation that fires when all conditions hold.
+
+    Rules with any plot.* condition are evaluated per plot and may format `details`
+    with {name} and {crop}; higher `priority` wins the top-N cut.
+    """
+    id: str
+    title: str
+    details: str
+    priority: int
+    conditions: tuple
+
+    @property
+    def sources(self):
+        return {c.source for c in self.conditions}
+
+    @property
+    def per_plot(self):
+        return bool(self.sources & {"crop", "sensor"})
+
+
+DEFAULT_RULES = (
+    Rule("weather_rain_alert", "Heavy Rain Forecasted", "Consider delaying irrigation to conserve water.", 100,
+         (Condition("weather.chance_of_rain_percent", ">", 70),)),
+    Rule("weather_humidity_alert", "High Humidity Alert", "Risk of fungal diseases. Ensure good air circulation.", 90,
+         (Condition("weather.condition", "==", "High Humidity"), Condition("weather.chance_of_rain_percent", "<=", 70))),
+    Rule("tomato_blight_risk", "Blight Risk for Tomatoes", "The high humidity puts your Tomatoes in {name} at high risk for Early Blight.", 80,
+         (Condition("plot.crop", "==", "Tomatoes"), Condition("weather.condition", "==", "High Humidity"))),
+    # soil_moisture is volumetric water content in percent.
+    Rule("low_soil_moisture", "Low Soil Moisture", "Soil in {name} is drying out. Irrigate your {crop} early in the morning.", 70,
+         (Condition("plot.soil_moisture", "<", 20), Condition("weather.chance_of_rain_percent", "<=", 70))),
+)
+
+
+class RuleEngine:
+    """Evaluates rules over columnar plot data and re-runs only the rules an update touches.
+
+    Plots are held as parallel arrays (crop codes, latest soil moisture) so a per-plot
+    rule is a handful of numpy comparisons however many plots there are. Each rule's
+    matches are cached; set_weather/set_plots/update_sensor only mark the rules that
+    read the changed input as dirty, and recommendations() re-evaluates just those.
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, top_n=4):
+        self.rules = {rule.id: rule for rule in rules}
+        self.top_n = top_n
+        self.rules_by_source = {}
+        for rule in rules:
+            for source in rule.sources:
+                self.rules_by_source.setdefault(source, set()).add(rule.id)
+        self.weather = {}
+        self.plot_ids = np.array([], dtype=object)
+        self.plot_names = np.array([], dtype=object)
+        self.crop_codes = np.array([], dtype=np.int32)
+        self.crop_vocab = {}
+        self.soil_moisture = np.array([], dtype=np.float32)
+        self._plot_index = {}
+        self._matches = {}
+        self._dirty = set(self.rules)
+        self._recommendations = []
+        self._digest = _digest([])
+        self._lock = threading.Lock()
+
+    # --- inputs ---
+    def set_weather(self, weather):
+        with self._lock:
+            changed = {key for key in weather.keys() | self.weather.keys() if weather.get(key) != self.weather.get(key)}
+            self.weather = dict(weather)
+            if changed:
+                self._dirty |= self.rules_by_source.get("weather", set())
+
+    def set_plots(self, plots):
+        """plots: {plot_id: {"name": ..., "crop": ...}}; existing moisture readings are kept."""
+        with self._lock:
+            old_moisture = {pid: self.soil_moisture[i] for pid, i in self._plot_index.items()}
+            ids = list(plots)
+            self._plot_index = {pid: i for i, pid in enumerate(ids)}
+            self.plot_ids = np.array(ids, dtype=object)
+            self.plot_names = np.array([plots[pid]["name"] for pid in ids], dtype=object)
+            for plot in plots.values():
+                self.crop_vocab.setdefault(plot["crop"], len(self.crop_vocab))
+            self.crop_codes = np.array([self.crop_vocab[plots[pid]["crop"]] for pid in ids], dtype=np.int32)
+            self.soil_moisture = np.array([old_moisture.get(pid, np.nan) for pid in ids], dtype=np.float32)
+            self._dirty |= {rule_id for rule_id, rule in self.rules.items() if rule.per_plot}
+
+    def update_sensor(self, plot_id, soil_moisture):
+        with self._lock:
+            i = self._plot_index.get(plot_id)
+            if i is None or self.soil_moisture[i] == soil_moisture:
+                return
+            self.soil_moisture[i] = soil_moisture
+            self._dirty |= self.rules_by_source.get("sensor", set())
+
+    # --- evaluation ---
+    def _weather_holds(self, condition):
+        value = self.weather.get(condition.field.split(".", 1)[1])
+        if value is None:
+            return False
+        if condition.op == "in":
+            return value in condition.value
+        return OPERATORS[condition.op](value, condition.value)
+
+    def _plot_mask(self, condition):
+        if condition.field == "plot.crop":
+            values = condition.value if condition.op == "in" else [condition.value]
+            codes = [self.crop_vocab[v] for v in values if v in self.crop_vocab]
+            mask = np.isin(self.crop_codes, codes)
+            return ~mask if condition.op == "!=" else mask
+        # NaN (no reading yet) compares False for every operator, so such plots never match.
+        return OPERATORS[condition.op](self.soil_moisture, condition.value)
+
+    def _evaluate(self, rule):
+        if not all(self._weather_holds(c) for c in rule.conditions if c.source == "weather"):
+            return np.array([], dtype=np.int64) if rule.per_plot else False
+        if not rule.per_plot:
+            return True
+        mask = np.ones(len(self.plot_ids), dtype=bool)
+        for condition in rule.conditions:
+            if condition.source != "weather":
+                mask &= self._plot_mask(condition)
+        return np.flatnonzero(mask)
+
+    def _render(self, rule, matches):
+        if not rule.per_plot:
+            return {"id": rule.id, "title": rule.title, "details": rule.details}
+        first = matches[0]
+        crop = next(name for name, code in self.crop_vocab.items() if code == self.crop_codes[first])
+        details = rule.details.format(name=self.plot_names[first], crop=crop)
+        if len(matches) > 1:
+            details += f" ({len(matches) - 1} more plots affected.)"
+        return {"id": f"{self.plot_ids[first]}_{rule.id}", "title": rule.title, "details": details}
+
+    def recommendations(self):
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """(recommendations, digest of them) taken together.
+
+        The digest depends only on the list's content, so every worker process that
+        renders the same recommendations gives the same value (used for ETags).
+        """
+        with self._lock:
+            if self._dirty:
+                for rule_id in self._dirty:
+                    self._matches[rule_id] = self._evaluate(self.rules[rule_id])
+                self._dirty.clear()
+                # Per-plot matches are index arrays (index 0 is a valid match), others are bools.
+                fired = [rule for rule_id, rule in self.rules.items()
+                         if (len(self._matches[rule_id]) if rule.per_plot else self._matches[rule_id])]
+                fired.sort(key=lambda rule: -rule.priority)
+                recommendations = [self._render(rule, self._matches[rule.id]) for rule in fired[:self.top_n]]
+                if recommendations != self._recommendations:
+                    self._recommendations = recommendations
+                    self._digest = _digest(recommendations)
+            return list(self._recommendations), self._digest
+
+
+def _digest(recommendations):
+    return hashlib.blake2b(json.dumps(recommendations, sort_keys=True).encode(), digest_size=8).hexdigest()
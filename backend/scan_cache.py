@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+HASH_BITS = 64
+BANDS = 8
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def content_hasher():
+    """Hasher for the exact-match key: update() it with the raw upload bytes, the key is hexdigest()."""
+    return hashlib.sha256()
+
+
+def perceptual_hash(image):
+    """64-bit difference hash: survives re-encoding, resizing and small exposure changes."""
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _bands(phash):
+    return [(phash >> (i * BAND_BITS)) & BAND_MASK for i in range(BANDS)]
+
+
+class _Entry:
+    __slots__ = ("phash", "value", "size", "created")
+
+    def __init__(self, phash, value, size, created):
+        self.phash, self.value, self.size, self.created = phash, value, size, created
+
+
+class ScanCache:
+    """Two-tier (memory LRU + optional SQLite) cache of scan results keyed by image content.
+
+    Lookups try the exact content hash first, then any stored perceptual hash within
+    `max_distance` bits. Near-duplicate candidates come from a banded index: with the
+    64-bit hash split into 8 bands, two hashes that differ in at most 7 bits share at
+    least one band exactly, so only entries in a matching band are compared.
+    """
+
+    def __init__(self, name, max_entries=2048, max_bytes=32 * 1024 * 1024, ttl_seconds=24 * 3600,
+                 max_distance=4, disk_dir=None):
+        if not 0 <= max_distance < BANDS:
+            raise ValueError(f"max_distance must be between 0 and {BANDS - 1}")
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self._band_index = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = self._open_disk(disk_dir) if disk_dir else None
+        self.counters = {"exact_hits": 0, "near_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    # --- public API ---
+    def get_exact(self, key):
+        with self._lock:
+            entry = self._get_memory(key)
+            if entry is None and self._db is not None:
+                entry = self._get_disk(key)
+            if entry is None:
+                return None
+            self.counters["exact_hits"] += 1
+            return entry.value
+
+    def get_near(self, phash):
+        with self._lock:
+            match = self._near_memory(phash)
+            if match is None and self._db is not None:
+                match = self._near_disk(phash)
+            if match is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["near_hits"] += 1
+            return match.value
+
+    def put(self, key, phash, value):
+        payload = json.dumps(value)
+        entry = _Entry(phash, value, len(payload), time.time())
+        with self._lock:
+            self._put_memory(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO scans (key, phash, value, created, b0, b1, b2, b3, b4, b5, b6, b7) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, f"{phash:016x}", payload, entry.created, *_bands(phash)),
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["exact_hits"] + self.counters["near_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "max_distance": self.max_distance,
+            }
+
+    # --- memory tier ---
+    def _expired(self, entry):
+        return time.time() - entry.created > self.ttl
+
+    def _get_memory(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _near_memory(self, phash):
+        candidates = set()
+        for i, band in enumerate(_bands(phash)):
+            candidates |= self._band_index.get((i, band), set())
+        best_key, best_distance = None, self.max_distance + 1
+        for key in candidates:
+            distance = (self._entries[key].phash ^ phash).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return self._get_memory(best_key) if best_key is not None else None
+
+    def _put_memory(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        for i, band in enumerate(_bands(entry.phash)):
+            self._band_index.setdefault((i, band), set()).add(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.counters["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for i, band in enumerate(_bands(entry.phash)):
+            keys = self._band_index.get((i, band))
+            keys.discard(key)
+            if not keys:
+                del self._band_index[(i, band)]
+
+    # --- disk tier ---
+    def _open_disk(self, disk_dir):
+        os.makedirs(disk_dir, exist_ok=True)
+        db = sqlite3.connect(os.path.join(disk_dir, f"{self.name}.sqlite3"), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS scans (key TEXT PRIMARY KEY, phash TEXT, value TEXT, created REAL, "
+            "b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER, b4 INTEGER, b5 INTEGER, b6 INTEGER, b7 INTEGER)"
+        )
+        for i in range(BANDS):
+            db.execute(f"CREATE INDEX IF NOT EXISTS scans_b{i} ON scans (b{i})")
+        db.execute("DELETE FROM scans WHERE created < ?", (time.time() - self.ttl,))
+        db.commit()
+        return db
+
+    def _promote(self, key, row):
+        phash, payload, created = row
+        entry = _Entry(int(phash, 16), json.loads(payload), len(payload), created)
+        if self._expired(entry):
+            self._db.execute("DELETE FROM scans WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._put_memory(key, entry)
+        self.counters["disk_hits"] += 1
+        return entry
+
+    def _get_disk(self, key):
+        row = self._db.execute("SELECT phash, value, created FROM scans WHERE key = ?", (key,)).fetchone()
+        return self._promote(key, row) if row else None
+
+    def _near_disk(self, phash):
+        where = " OR ".join(f"b{i} = ?" for i in range(BANDS))
+        rows = self._db.execute(f"SELECT key, phash FROM scans WHERE {where}", _bands(phash)).fetchall()
+        best_key, best_distance = None, self.max_distance + 1
+        for key, stored in rows:
+            distance = (int(stored, 16) ^ phash).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return self._get_disk(best_key) if best_key is not None else None
@@ -0,0 +1,170 @@
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+_STOPWORDS = frozenset("a an the is are was were be to of for in on at and or my our your i we me what how which should can do does please tell about".split())
+# Words that change what a question is about while barely moving its embedding: the crop,
+# pest or input it names (stemmed, as _stem leaves them). Two queries only share an answer
+# when these, any numbers and negation agree.
+_SUBJECT_TERMS = frozenset("""
+    wheat paddy rice maize corn bajra jowar millet ragi barley sugarcane cotton soybean soyabean groundnut peanut
+    mustard gram chickpea chana lentil masoor moong urad arhar tur pea potato onion garlic tomato brinjal eggplant
+    chilli chilly chili capsicum okra bhindi cabbage cauliflower carrot radish cucumber pumpkin gourd spinach
+    banana mango papaya guava grape apple orange citrus lemon pomegranate coconut arecanut tea coffee jute
+    sunflower sesame turmeric ginger cumin coriander cardamom pepper
+    urea dap npk potash mop ssp zinc sulphur sulfur boron gypsum lime compost vermicompost manure biochar
+    neem jeevamrut jeevamrutha glyphosate imidacloprid chlorpyrifo mancozeb copper trichoderma pseudomona
+    aphid whitefly thrip borer bollworm armyworm jassid mite nematode locust termite weevil hopper caterpillar
+    blight rust wilt mildew rot smut blast mosaic curl
+    cow buffalo goat sheep poultry chicken fish bee
+""".split())
+_NEGATIONS = frozenset("not no never without cannot nor t".split())  # "don't" normalises to "don t"
+
+
+def normalize_query(text):
+    """Lowercase, strip punctuation and collapse whitespace so trivial variants match exactly."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", text.lower())).strip()
+
+
+class HashingEmbedder:
+    """Local CPU embedding from hashed word stems, 3-letter prefixes and word bigrams.
+
+    No model download and ~10 µs per query; good enough to catch rephrasings of the
+    same question. Any callable returning an L2-normalised float32 vector can be
+    passed to SemanticCache instead.
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _add(self, vector, feature, weight):
+        h = zlib.crc32(feature.encode())
+        vector[h % self.dim] += weight if h & 0x80000000 else -weight
+
+    def __call__(self, normalized):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = [_stem(w) for w in normalized.split() if w not in _STOPWORDS]
+        for word in words:
+            self._add(vector, "w:" + word, 1.0)
+            self._add(vector, "p:" + word[:3], 0.5)
+        for left, right in zip(words, words[1:]):
+            self._add(vector, f"b:{left} {right}", 0.5)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def query_subject(normalized):
+    """What a normalised query is about: its crop/pest/input terms, numbers and whether it is negated.
+
+    >>> same = lambda a, b: query_subject(normalize_query(a)) == query_subject(normalize_query(b))
+    >>> same("What is the urea dose for wheat per acre?", "What is the urea dose for paddy per acre?")
+    False
+    >>> same("How much neem oil spray should I use on tomato plants?", "How much neem oil should I spray on brinjal?")
+    False
+    >>> same("Is neem oil safe for bees?", "Is neem oil not safe for bees?")
+    False
+    >>> same("How much urea should I apply to wheat?", "how much urea to apply on wheat crop")
+    True
+    >>> same("How do I control aphids on mustard?", "how to control aphids in mustard crops")
+    True
+    """
+    words = normalized.split()
+    terms = frozenset(w for w in map(_stem, words) if w in _SUBJECT_TERMS or w.isdigit())
+    return terms, any(w in _NEGATIONS for w in words)
+
+
+def _stem(word):
+    for suffix, replacement in (("ies", "y"), ("oes", "o"), ("es", "e"), ("s", "")):
+        if len(word) > 3 and word.endswith(suffix) and not word.endswith("ss"):
+            return word[: -len(suffix)] + replacement
+    return word
+
+
+class SemanticCache:
+    """Answer cache: normalised exact match first, then nearest past query by cosine similarity.
+
+    A similar query only counts when `subject` (query_subject by default) is the same
+    for both: bag-of-words similarity scores "urea for wheat" and "urea for paddy", or
+    "is X safe" and "is X not safe", as near-duplicates.
+
+    Memory is bounded by `capacity` (one preallocated embedding row per entry); entries
+    expire after `ttl_seconds` and the least recently used one is evicted when full.
+    """
+
+    def __init__(self, capacity=2048, ttl_seconds=6 * 3600, threshold=0.85, embedder=None, dim=512, subject=query_subject):
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self.threshold = threshold
+        self.embedder = embedder or HashingEmbedder(dim)
+        self.subject = subject
+        self._vectors = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self._subjects = np.zeros(capacity, dtype=np.int64)  # hash of each slot's subject
+        self._live = np.zeros(capacity, dtype=bool)
+        self._slot_keys = [None] * capacity
+        self._entries = OrderedDict()  # normalised query -> (slot, answer, created)
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0}
+
+    def get(self, query, bypass=False):
+        key = normalize_query(query)
+        with self._lock:
+            if bypass:
+                self.counters["bypassed"] += 1
+                return None
+            entry = self._get_entry(key)
+            if entry is not None:
+                self.counters["exact_hits"] += 1
+                return entry[1]
+            if self._live.any():
+                scores = self._vectors @ self.embedder(key)
+                scores[~self._live | (self._subjects != hash(self.subject(key)))] = -1.0
+                slot = int(scores.argmax())
+                if scores[slot] >= self.threshold:
+                    entry = self._get_entry(self._slot_keys[slot])
+                    if entry is not None:
+                        self.counters["semantic_hits"] += 1
+                        return entry[1]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, query, answer):
+        key = normalize_query(query)
+        vector = self.embedder(key)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if not self._free:
+                self._remove(next(iter(self._entries)))
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._subjects[slot] = hash(self.subject(key))
+            self._live[slot] = True
+            self._slot_keys[slot] = key
+            self._entries[key] = (slot, answer, time.time())
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "capacity": self.capacity, "threshold": self.threshold}
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[2] > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key):
+        slot, _, _ = self._entries.pop(key)
+        self._live[slot] = False
+        self._slot_keys[slot] = None
+        self._free.append(slot)
@@ -0,0 +1,149 @@
+import threading
+
+import numpy as np
+
+# Rollup resolutions: bucket width in ms and how many buckets are retained per plot.
+ROLLUPS = {"minute": (60_000, 7 * 24 * 60), "hour": (3_600_000, 90 * 24)}
+MAX_TIMESTAMP_MS = 253_402_300_800_000  # 10000-01-01T00:00Z
+
+
+class RingBuffer:
+    """Fixed-capacity columnar store of (timestamp ms int64, moisture float32) readings."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.moisture = np.zeros(capacity, dtype=np.float32)
+        self.head = 0
+        self.size = 0
+
+    def extend(self, timestamps, moisture):
+        if len(timestamps) > self.capacity:
+            timestamps, moisture = timestamps[-self.capacity:], moisture[-self.capacity:]
+        idx = (self.head + np.arange(len(timestamps))) % self.capacity
+        self.timestamps[idx] = timestamps
+        self.moisture[idx] = moisture
+        self.head = (self.head + len(timestamps)) % self.capacity
+        self.size = min(self.size + len(timestamps), self.capacity)
+
+    def latest(self):
+        """Most recently received reading."""
+        if not self.size:
+            return None
+        i = (self.head - 1) % self.capacity
+        return int(self.timestamps[i]), float(self.moisture[i])
+
+
+class Rollup:
+    """min/mean/max per fixed-width bucket, kept in a ring of `retention` buckets.
+
+    A slot is reused when a newer bucket maps onto it; readings older than the
+    bucket currently in their slot are past retention and are dropped.
+    """
+
+    def __init__(self, width_ms, retention):
+        self.width = width_ms
+        self.retention = retention
+        self.bucket = np.full(retention, -1, dtype=np.int64)
+        self.min = np.full(retention, np.inf, dtype=np.float32)
+        self.max = np.full(retention, -np.inf, dtype=np.float32)
+        self.sum = np.zeros(retention, dtype=np.float64)
+        self.count = np.zeros(retention, dtype=np.int64)
+
+    def add(self, timestamps, moisture):
+        buckets = timestamps // self.width
+        slots = buckets % self.retention
+        new_buckets = np.unique(buckets)
+        new_slots = new_buckets % self.retention
+        stale = new_slots[self.bucket[new_slots] < new_buckets]
+        if len(stale):
+            # np.unique is sorted, so if a batch spans more than the retention the
+            # newest bucket wins each slot.
+            self.bucket[new_slots] = np.maximum(self.bucket[new_slots], new_buckets)
+            self.min[stale], self.max[stale], self.sum[stale], self.count[stale] = np.inf, -np.inf, 0, 0
+        valid = self.bucket[slots] == buckets
+        slots, values = slots[valid], moisture[valid]
+        np.minimum.at(self.min, slots, values)
+        np.maximum.at(self.max, slots, values)
+        np.add.at(self.sum, slots, values)
+        np.add.at(self.count, slots, 1)
+
+    def query(self, start_ms, end_ms):
+        mask = (self.count > 0) & (self.bucket * self.width >= start_ms) & (self.bucket * self.width < end_ms)
+        order = np.argsort(self.bucket[mask])
+        starts = (self.bucket[mask] * self.width)[order]
+        return [
+            {"bucket_start_ms": int(s), "min": float(lo), "mean": float(total / n), "max": float(hi), "count": int(n)}
+            for s, lo, hi, total, n in zip(starts, self.min[mask][order], self.max[mask][order], self.sum[mask][order], self.count[mask][order])
+        ]
+
+
+class SensorStore:
+    """Per-plot soil-moisture readings: a raw ring buffer plus minute and hour rollups.
+
+    Memory per plot is fixed (about 12 bytes per raw slot plus 32 per rollup bucket)
+    however many readings arrive. Held in process memory; each worker keeps its own.
+    """
+
+    def __init__(self, capacity=100_000):
+        self.capacity = capacity
+        self._plots = {}
+        self._lock = threading.Lock()
+
+    def _plot(self, plot_id):
+        plot = self._plots.get(plot_id)
+        if plot is None:
+            plot = self._plots[plot_id] = {
+                "raw": RingBuffer(self.capacity),
+                "rollups": {name: Rollup(width, retention) for name, (width, retention) in ROLLUPS.items()},
+            }
+        return plot
+
+    def ingest(self, plot_id, timestamps, moisture):
+        self.ingest_many({plot_id: (timestamps, moisture)})
+
+    def ingest_many(self, readings):
+        """Stores {plot_id: (timestamps, moisture)} all or nothing.
+
+        Every plot's readings are converted and checked before any are stored, so a
+        malformed value raises ValueError/TypeError with nothing written.
+        """
+        batches = [(plot_id, *_columns(timestamps, moisture)) for plot_id, (timestamps, moisture) in readings.items()]
+        with self._lock:
+            for plot_id, timestamps, moisture in batches:
+                if not len(timestamps):
+                    continue
+                plot = self._plot(plot_id)
+                plot["raw"].extend(timestamps, moisture)
+                for rollup in plot["rollups"].values():
+                    rollup.add(timestamps, moisture)
+
+    def latest(self, plot_id):
+        with self._lock:
+            plot = self._plots.get(plot_id)
+            return plot["raw"].latest() if plot else None
+
+    def rollups(self, plot_id, resolution, start_ms, end_ms):
+        with self._lock:
+            plot = self._plots.get(plot_id)
+            return plot["rollups"][resolution].query(start_ms, end_ms) if plot else []
+
+
+def _columns(timestamps, moisture):
+    """Readings as 1-D int64/float32 arrays in timestamp order.
+
+    Moisture must be finite and timestamps within [0, MAX_TIMESTAMP_MS]; a negative
+    bucket would read as the rollups' empty-slot marker. Raises ValueError otherwise,
+    or OverflowError for a timestamp too large for int64.
+    """
+    with np.errstate(over="ignore", invalid="ignore"):
+        moisture = np.asarray(moisture, dtype=np.float32)  # None becomes NaN, 1e40 becomes inf
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if timestamps.ndim != 1 or timestamps.shape != moisture.shape:
+        raise ValueError("timestamps and soil_moisture must be flat lists of the same length")
+    if not np.isfinite(moisture).all():
+        raise ValueError("soil_moisture must be a finite number")
+    if ((timestamps < 0) | (timestamps > MAX_TIMESTAMP_MS)).any():
+        raise ValueError(f"timestamp_ms must be between 0 and {MAX_TIMESTAMP_MS}")
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], moisture[order]
@@ -0,0 +1,183 @@
+"""Runs the API on several worker processes with a single copy of the BLIP weights.
+
+    python serve.py --mode prefork --workers 4 --port 8000
+    python serve.py --mode caption-server --workers 4 --port 8000
+
+`uvicorn main:app --workers N` imports main.py in every worker, and each worker
+loads its own captioner, so memory grows with the worker count. Here a master
+process binds the listening socket, forks the workers and restarts any that die.
+
+prefork         The master loads the caption engine and then forks. Workers share
+                its weights copy-on-write, because inference only reads them and
+                gc.freeze() stops the collector from writing to the pages. Each
+                worker runs its own batcher on cpus/workers torch threads
+                (CAPTION_THREADS overrides this). The ONNX engine is not supported,
+                because ONNX Runtime sessions do not survive fork.
+caption-server  The master starts one caption_server.py process, which loads the
+                model. Workers send it images over a Unix socket, where they are
+                batched together. Model memory and compute are those of a single
+                process, and that process's threads are the captioning capacity.
+
+Measured with `bench.py --workers 4 --stub-model-mb 600` (600 MB of resident
+stand-in weights, classify-waste closed loop), total PSS of the server processes:
+independent workers (uvicorn --workers 4) 2879 MB, prefork 1072 MB,
+caption-server 1097 MB, at about the same throughput.
+
+Only SQLite state is shared between workers: farm data, the carbon ledger and
+EcoBot sessions. The rest lives in each worker and diverges:
+- soil-moisture ring buffers, their rollups and the rule engine's latest
+  readings only see the readings posted to that worker, so send a plot's
+  sensor stream to a single worker (or run one worker) if /plots rollups or
+  recommendations must reflect all of it,
+- /metrics and /cache-stats describe the worker that answered; scrape each
+  worker or sum them,
+- the scan and EcoBot answer caches and the local waste classifier fill up
+  separately, and waste_local.json is written by whichever worker exits last,
+- LLM_RATE_PER_SEC and LLM_BURST are per worker, so divide them by the
+  worker count to keep the same total rate to Gemini.
+
+Linux and macOS only (fork, Unix sockets).
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from inference import make_caption_engine, share_caption_engine
+
+MODES = ("prefork", "caption-server")
+RESTART_BACKOFF_SECONDS = 1.0
+
+
+def preload_caption_engine():
+    """Loads the engine in the master on one thread. Torch's OpenMP pool would not survive fork,
+    so it is only created later, inside each worker."""
+    engine = make_caption_engine(intra_op_threads=1, inter_op_threads=None)
+    if engine.name == "onnx":
+        raise SystemExit("ONNX Runtime sessions do not survive fork; use --mode caption-server for the onnx engine.")
+    return engine.load()
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks named child processes and restarts any that exit until the master is told to stop."""
+
+    def __init__(self):
+        self.children = {}  # pid -> (name, target, started)
+        self.stopping = False
+
+    def spawn(self, name, target):
+        pid = os.fork()
+        if pid == 0:
+            # The child must not run the master's handlers or fall back into its code.
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                target()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = (name, target, time.monotonic())
+        return pid
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            name, target, started = self.children.pop(pid, (None, None, None))
+            if name is None or self.stopping:
+                continue
+            print(f"{name} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; restarting.", file=sys.stderr)
+            if time.monotonic() - started < RESTART_BACKOFF_SECONDS:
+                time.sleep(RESTART_BACKOFF_SECONDS)  # don't spin on a worker that fails at import
+            self.spawn(name, target)
+
+
+def api_worker(sock, threads, log_level):
+    def run():
+        import uvicorn
+
+        if threads and "torch" in sys.modules:  # only when the master preloaded a torch engine
+            import torch
+
+            torch.set_num_threads(threads)
+        config = uvicorn.Config("main:app", log_level=log_level)
+        uvicorn.Server(config).run(sockets=[sock])
+
+    return run
+
+
+def run(mode, workers, host="0.0.0.0", port=8000, caption_socket=None, engine_factory=None, log_level="info"):
+    """Serves main:app on `workers` forked processes until SIGTERM/SIGINT.
+
+    `engine_factory` returns a loaded caption engine (default: CAPTION_ENGINE, see inference.py).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown serving mode '{mode}', expected one of {MODES}")
+    supervisor = Supervisor()
+    threads = None
+    if mode == "prefork":
+        share_caption_engine((engine_factory or preload_caption_engine)())
+        threads = int(os.getenv("CAPTION_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+    else:
+        import caption_server
+
+        caption_socket = caption_socket or f"/tmp/agrosage-caption-{os.getpid()}.sock"
+        os.environ["CAPTION_SERVER_SOCKET"] = caption_socket
+        supervisor.spawn("caption server", lambda: caption_server.serve(caption_socket, engine_factory and engine_factory()))
+    # Everything allocated so far (the model above all) is moved out of the collector's
+    # reach, so collections in the workers don't write to the shared pages.
+    gc.collect()
+    gc.freeze()
+    sock = bind_socket(host, port)
+    for i in range(workers):
+        supervisor.spawn(f"worker {i}", api_worker(sock, threads, log_level))
+    print(f"Serving on http://{host}:{port} with {workers} {mode} workers (master pid {os.getpid()})")
+    supervisor.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=MODES, default="prefork")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--caption-socket", help="Unix socket of the caption server (caption-server mode)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    run(args.mode, args.workers, args.host, args.port, args.caption_socket, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
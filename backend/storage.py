@@ -0,0 +1,286 @@
+import json
+import queue
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from conversation import Session
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plots (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    crop TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plot_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    plot_id TEXT NOT NULL REFERENCES plots (id),
+    timestamp TEXT NOT NULL,
+    soil_moisture REAL NOT NULL,
+    pest_sighting TEXT
+);
+CREATE INDEX IF NOT EXISTS plot_logs_plot_time ON plot_logs (plot_id, timestamp);
+CREATE TABLE IF NOT EXISTS missions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    reward INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS missions_completed ON missions (completed);
+CREATE TABLE IF NOT EXISTS carbon_ledger (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    activity TEXT NOT NULL,
+    credits INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS carbon_ledger_time ON carbon_ledger (timestamp);
+CREATE TABLE IF NOT EXISTS ecobot_sessions (
+    id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    turns TEXT NOT NULL,
+    compacting_since REAL NOT NULL,
+    touched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ecobot_sessions_touched ON ecobot_sessions (touched);
+CREATE TABLE IF NOT EXISTS farm_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dashboard_aggregates (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    sustainability_score INTEGER NOT NULL,
+    active_missions INTEGER NOT NULL,
+    carbon_credits INTEGER NOT NULL,
+    version INTEGER NOT NULL
+);
+"""
+
+# Demo farm the app starts with (previously the in-memory fake_db).
+SEED = {
+    "plots": {"plot_a": {"name": "North Field", "crop": "Tomatoes"}, "plot_b": {"name": "West Patch", "crop": "Corn"}},
+    "missions": [{"id": "m1", "title": "Start a Compost Pile", "reward": 20, "completed": False}, {"id": "m2", "title": "Apply Neem Oil", "reward": 30, "completed": False}, {"id": "m3", "title": "Install Drip Irrigation", "reward": 50, "completed": False}, {"id": "m4", "title": "Crop Rotation Plan", "reward": 25, "completed": True}],
+    "carbon_ledger": [{"timestamp": "2024-03-10T10:00:00Z", "activity": "Completed Mission: Crop Rotation Plan", "credits": 25}],
+    "sustainability_score": 35,
+    "weather_forecast": {"condition": "High Humidity", "temperature_celsius": 28, "chance_of_rain_percent": 80},
+}
+
+
+class ConnectionPool:
+    """Fixed set of SQLite connections handed out to worker threads one at a time."""
+
+    def __init__(self, path, size=4):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._connections.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE takes the write lock up front, so read-modify-write sequences
+        inside the block can't interleave with another writer (thread or process)."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+
+class FarmStore:
+    """Durable farm state (plots, sensor logs, missions, carbon ledger) in SQLite/WAL.
+
+    Methods are blocking; call them from sync endpoints or via asyncio.to_thread.
+    """
+
+    def __init__(self, path="agrosage.db", pool_size=4):
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.transaction() as conn:
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            if conn.execute("SELECT COUNT(*) FROM missions").fetchone()[0] == 0:
+                self._seed(conn)
+            if conn.execute("SELECT 1 FROM dashboard_aggregates").fetchone() is None:
+                self._backfill_aggregates(conn)
+            # Identifies this database file, so copies derived from it (the ledger segments) can tell it was replaced.
+            conn.execute("INSERT OR IGNORE INTO farm_state (key, value) VALUES ('instance_id', ?)", (json.dumps(uuid.uuid4().hex),))
+            self.instance_id = self._state(conn, "instance_id")
+
+    def _seed(self, conn):
+        conn.executemany("INSERT INTO plots (id, name, crop) VALUES (?, ?, ?)",
+                         [(plot_id, p["name"], p["crop"]) for plot_id, p in SEED["plots"].items()])
+        conn.executemany("INSERT INTO missions (id, title, reward, completed) VALUES (?, ?, ?, ?)",
+                         [(m["id"], m["title"], m["reward"], int(m["completed"])) for m in SEED["missions"]])
+        conn.executemany("INSERT INTO carbon_ledger (timestamp, activity, credits) VALUES (?, ?, ?)",
+                         [(e["timestamp"], e["activity"], e["credits"]) for e in SEED["carbon_ledger"]])
+        conn.execute("INSERT INTO farm_state (key, value) VALUES ('weather_forecast', ?)", (json.dumps(SEED["weather_forecast"]),))
+
+    def _backfill_aggregates(self, conn):
+        """One full scan when the aggregates row is first created; writes keep it current after that."""
+        # Databases created before the aggregates table kept the score in farm_state.
+        row = conn.execute("SELECT value FROM farm_state WHERE key = 'sustainability_score'").fetchone()
+        score = json.loads(row[0]) if row else SEED["sustainability_score"]
+        conn.execute("DELETE FROM farm_state WHERE key = 'sustainability_score'")
+        conn.execute(
+            "INSERT INTO dashboard_aggregates (id, sustainability_score, active_missions, carbon_credits, version) VALUES (1, ?, "
+            "(SELECT COUNT(*) FROM missions WHERE completed = 0), (SELECT COALESCE(SUM(credits), 0) FROM carbon_ledger), 1)",
+            (score,),
+        )
+
+    # --- reads ---
+    def _state(self, conn, key):
+        return json.loads(conn.execute("SELECT value FROM farm_state WHERE key = ?", (key,)).fetchone()[0])
+
+    def plots(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT id, name, crop FROM plots ORDER BY id").fetchall()
+        return {row["id"]: {"name": row["name"], "crop": row["crop"]} for row in rows}
+
+    def missions(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT id, title, reward, completed FROM missions ORDER BY id").fetchall()
+        return [{"id": r["id"], "title": r["title"], "reward": r["reward"], "completed": bool(r["completed"])} for r in rows]
+
+    def weather_forecast(self):
+        with self.pool.connection() as conn:
+            return self._state(conn, "weather_forecast")
+
+    def dashboard_totals(self):
+        """Running totals plus `version`, which every write that can change the dashboard bumps."""
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT sustainability_score, active_missions, carbon_credits, version FROM dashboard_aggregates").fetchone()
+        return dict(row)
+
+    def plot_logs(self, plot_id, since=None, limit=100):
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT plot_id, soil_moisture, pest_sighting, timestamp FROM plot_logs "
+                "WHERE plot_id = ? AND timestamp >= ? ORDER BY timestamp DESC LIMIT ?",
+                (plot_id, since or "", limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest_soil_moisture(self):
+        """{plot_id: soil_moisture} from each plot's most recent log."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT plot_id, soil_moisture FROM plot_logs WHERE id IN (SELECT MAX(id) FROM plot_logs GROUP BY plot_id)"
+            ).fetchall()
+        return {row["plot_id"]: row["soil_moisture"] for row in rows}
+
+    def ledger_entry(self, entry_id):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT id, timestamp, activity, credits FROM carbon_ledger WHERE id = ?", (entry_id,)).fetchone()
+        return dict(row) if row else None
+
+    def ledger_entries_after(self, entry_id, limit=10000):
+        """Ledger rows with id > entry_id, oldest first; CarbonLedger.sync pages through these."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, timestamp, activity, credits FROM carbon_ledger WHERE id > ? ORDER BY id LIMIT ?", (entry_id, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # --- writes ---
+    def add_plot_log(self, plot_id, soil_moisture, pest_sighting=None):
+        """Returns the stored log, or None if the plot doesn't exist."""
+        entry = {"plot_id": plot_id, "soil_moisture": soil_moisture, "pest_sighting": pest_sighting, "timestamp": datetime.now().isoformat()}
+        with self.pool.transaction() as conn:
+            if conn.execute("SELECT 1 FROM plots WHERE id = ?", (plot_id,)).fetchone() is None:
+                return None
+            conn.execute("INSERT INTO plot_logs (plot_id, timestamp, soil_moisture, pest_sighting) VALUES (?, ?, ?, ?)",
+                         (plot_id, entry["timestamp"], soil_moisture, pest_sighting))
+            conn.execute("UPDATE dashboard_aggregates SET version = version + 1")
+        return entry
+
+    def complete_mission(self, mission_id):
+        """Marks the mission done and credits its reward once; returns the ledger entry, or
+        None if the mission doesn't exist or was already completed."""
+        with self.pool.transaction() as conn:
+            mission = conn.execute("SELECT title, reward FROM missions WHERE id = ? AND completed = 0", (mission_id,)).fetchone()
+            if mission is None:
+                return None
+            conn.execute("UPDATE missions SET completed = 1 WHERE id = ?", (mission_id,))
+            entry = {"timestamp": datetime.now().isoformat(), "activity": f"Completed Mission: {mission['title']}", "credits": mission["reward"]}
+            conn.execute("INSERT INTO carbon_ledger (timestamp, activity, credits) VALUES (?, ?, ?)",
+                         (entry["timestamp"], entry["activity"], entry["credits"]))
+            conn.execute(
+                "UPDATE dashboard_aggregates SET sustainability_score = sustainability_score + ?, "
+                "active_missions = active_missions - 1, carbon_credits = carbon_credits + ?, version = version + 1",
+                (mission["reward"], mission["reward"]),
+            )
+        return entry
+
+
+class SessionTable:
+    """EcoBot sessions (conversation.ConversationMemory) in SQLite, shared by every worker process.
+
+    Same interface as conversation.MemorySessions: `edit` reads a session and writes it
+    back in one BEGIN IMMEDIATE transaction, so concurrent turns of a session from
+    different workers don't lose each other; `get` is a plain read. A compaction whose worker died is given
+    up after `compaction_timeout` seconds.
+    """
+
+    def __init__(self, pool, capacity=50000, ttl_seconds=24 * 3600, compaction_timeout=300):
+        self.pool = pool
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self.compaction_timeout = compaction_timeout
+        self.counters = {"evicted": 0, "expired": 0}  # by this process
+
+    @contextmanager
+    def edit(self, session_id, create=False):
+        now = time.time()
+        with self.pool.transaction() as conn:
+            self.counters["expired"] += conn.execute("DELETE FROM ecobot_sessions WHERE touched < ?", (now - self.ttl,)).rowcount
+            row = conn.execute("SELECT summary, turns, compacting_since FROM ecobot_sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None and not create:
+                yield None
+                return
+            since = row["compacting_since"] if row else 0.0
+            session = Session(row["summary"], map(tuple, json.loads(row["turns"])), now - since < self.compaction_timeout) if row else Session()
+            yield session
+            since = (since if now - since < self.compaction_timeout else now) if session.compacting else 0.0
+            conn.execute(
+                "INSERT OR REPLACE INTO ecobot_sessions (id, summary, turns, compacting_since, touched) VALUES (?, ?, ?, ?, ?)",
+                (session_id, session.summary, json.dumps(session.turns), since, now),
+            )
+            if row is None:
+                self.counters["evicted"] += conn.execute(
+                    "DELETE FROM ecobot_sessions WHERE id IN (SELECT id FROM ecobot_sessions ORDER BY touched DESC LIMIT -1 OFFSET ?)",
+                    (self.capacity,),
+                ).rowcount
+
+    def get(self, session_id):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT summary, turns, compacting_since FROM ecobot_sessions WHERE id = ? AND touched >= ?",
+                (session_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return Session(row["summary"], map(tuple, json.loads(row["turns"])), time.time() - row["compacting_since"] < self.compaction_timeout)
+
+    def delete(self, session_id):
+        with self.pool.transaction() as conn:
+            return conn.execute("DELETE FROM ecobot_sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM ecobot_sessions").fetchone()[0]
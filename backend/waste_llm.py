@@ -0,0 +1,131 @@
+import os
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+from metrics import stage
+
+# serial: three chained round trips (original behaviour), parallel: the same three
+# chains fanned out at once, structured: a single call returning all three fields.
+WASTE_LLM_MODES = ("serial", "parallel", "structured")
+WASTE_LLM_MODE = os.getenv("WASTE_LLM_MODE", "parallel")
+
+WasteCategory = Literal["biodegradable", "non-biodegradable", "recyclable", "medical", "electronic"]
+
+
+class StructuredWasteLabels(BaseModel):
+    category: WasteCategory = Field(description="Waste type of the item, lowercase.")
+    bin_color: str = Field(description="Dustbin colour under Indian norms: green, blue, red, yellow, black, or the sanitary rule.")
+    explanation: str = Field(description="One line explaining why the item goes into that bin.")
+
+
+STRUCTURED_PROMPT = (
+    "Item: '{caption}'. Using Indian waste management norms, give:\n"
+    "1. category: one of biodegradable, non-biodegradable, recyclable, medical, electronic.\n"
+    "2. bin_color: green, blue, red, yellow, black, or for sanitary waste 'red (preferred), or blue if red is not available (must be securely wrapped)'.\n"
+    "3. explanation: one line on why it goes into that bin (Green: Wet, Blue: Dry, Red/Yellow: Medical, Black: E-waste)."
+)
+
+
+def timed(name, chain):
+    """`chain` with each call's latency recorded as stage `name` (sync and async)."""
+    from langchain_core.runnables import RunnableLambda
+
+    def run(inputs):
+        with stage(name):
+            return chain.invoke(inputs)
+
+    async def arun(inputs):
+        with stage(name):
+            return await chain.ainvoke(inputs)
+
+    return RunnableLambda(run, afunc=arun, name=name)
+
+
+class WasteLabeler:
+    """Turns a caption into {category, bin_color, explanation} using one of WASTE_LLM_MODES.
+
+    With a `local` classifier (waste_local.LocalWasteClassifier), captions it is confident
+    about skip the LLM, and every LLM answer is fed back to it. The LLM can be attached
+    later (LangChain is only imported then), so local labels work while it loads.
+    """
+
+    def __init__(self, llm=None, prompt_category=None, prompt_bin=None, prompt_explain=None, mode=WASTE_LLM_MODE, prompt_all=None, local=None):
+        if mode not in WASTE_LLM_MODES:
+            raise ValueError(f"Unknown waste LLM mode '{mode}', expected one of {WASTE_LLM_MODES}")
+        self.mode = mode
+        self.local = local
+        self.chains = None
+        if llm is not None:
+            self.attach(llm, prompt_category, prompt_bin, prompt_explain, prompt_all)
+
+    def attach(self, llm, prompt_category, prompt_bin, prompt_explain, prompt_all=None):
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.runnables import RunnableParallel
+
+        prompt_all = prompt_all or ChatPromptTemplate.from_template(STRUCTURED_PROMPT)
+        chains = {
+            "category": timed("llm_category", prompt_category | llm | StrOutputParser()),
+            "bin_color": timed("llm_bin_color", prompt_bin | llm | StrOutputParser()),
+            "explanation": timed("llm_explanation", prompt_explain | llm | StrOutputParser()),
+        }
+        self.chain_parallel = RunnableParallel(**chains)
+        # Built only when selected: not every chat model implements structured output.
+        self.chain_structured = timed("llm_structured", prompt_all | llm.with_structured_output(StructuredWasteLabels)) if self.mode == "structured" else None
+        self.chains = chains
+
+    def classify_local(self, caption):
+        """Labels from the local classifier, or None when the caption needs the LLM."""
+        if self.local is None:
+            return None
+        with stage("waste_local"):
+            return self.local.classify(caption)
+
+    def label(self, caption, before_llm=None):
+        """Local labels when confident, else the LLM's (learned). `before_llm()` runs only
+        when the LLM is needed, e.g. to refuse while it isn't loaded."""
+        labels = self.classify_local(caption)
+        if labels is None:
+            if before_llm is not None:
+                before_llm()
+            labels = self.label_llm(caption)
+            if self.local is not None:
+                self.local.learn(caption, labels)
+        return labels
+
+    async def alabel(self, caption, before_llm=None):
+        labels = self.classify_local(caption)
+        if labels is None:
+            if before_llm is not None:
+                before_llm()
+            labels = await self.alabel_llm(caption)
+            if self.local is not None:
+                self.local.learn(caption, labels)
+        return labels
+
+    def _require_llm(self):
+        if self.chains is None:
+            raise RuntimeError("No LLM attached to the waste labeler")
+
+    def label_llm(self, caption):
+        self._require_llm()
+        inputs = {"caption": caption}
+        if self.mode == "structured":
+            return self.chain_structured.invoke(inputs).model_dump()
+        if self.mode == "parallel":
+            results = self.chain_parallel.invoke(inputs)
+        else:
+            results = {key: chain.invoke(inputs) for key, chain in self.chains.items()}
+        return {key: value.strip() for key, value in results.items()}
+
+    async def alabel_llm(self, caption):
+        self._require_llm()
+        inputs = {"caption": caption}
+        if self.mode == "structured":
+            return (await self.chain_structured.ainvoke(inputs)).model_dump()
+        if self.mode == "parallel":
+            results = await self.chain_parallel.ainvoke(inputs)
+        else:
+            results = {key: await chain.ainvoke(inputs) for key, chain in self.chains.items()}
+        return {key: value.strip() for key, value in results.items()}
@@ -0,0 +1,341 @@
+"""Local waste labels for common captions, so only the unusual ones reach Gemini.
+
+    python waste_local.py waste_audit.jsonl --out waste_local.json
+    python waste_local.py waste_audit.jsonl --holdout 0.2
+
+BLIP describes most uploads with a few hundred captions ("a plastic bottle on a
+table"). LocalWasteClassifier answers a caption from, in order:
+  1. memory    the labels Gemini gave this exact (normalised) caption before,
+  2. keywords  the built-in lexicon of words and phrases, looking only at the
+               item and not the scene it is in, when it accounts for the whole
+               item ("a man wearing a face mask" is about the man),
+  3. model     a naive Bayes model over caption lemmas and bigrams, trained
+               online on every Gemini answer, when its posterior is confident.
+Anything else returns None and goes to the LLM, whose answer is then learned.
+The CLI trains a model file from waste.py's JSONL output and, with --holdout,
+reports how many held-out captions it would answer locally and how accurately.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from semantic_cache import normalize_query
+
+CATEGORIES = ("biodegradable", "non-biodegradable", "recyclable", "medical", "electronic")
+SANITARY_BIN = "red (preferred), or blue if red is not available (must be securely wrapped)"
+BIN_REASONS = {
+    "green": "wet waste that breaks down naturally and can be composted",
+    "blue": "dry waste that is kept out of the wet stream so it can be recycled or sent for processing",
+    "red": "contaminated biomedical waste that must be treated before disposal",
+    "yellow": "biomedical waste that has to be incinerated",
+    "black": "e-waste whose metals and chemicals need an authorised recycler",
+    SANITARY_BIN: "sanitary waste that has to be wrapped and kept apart from other dry waste",
+}
+
+_IRREGULAR = {"leaves": "leaf", "knives": "knife", "peelings": "peel", "scraps": "scrap", "glasses": "glass", "mice": "mouse"}
+_STOPWORDS = frozenset("a an the of on in at with and or is are some there this that it its next to near top lying sitting".split())
+
+# Lemma or two-lemma phrase -> (category, bin). Only words that decide the label on their own:
+# "can", "mask", "cup", "glove", "tea", "coffee" and "orange" are left out, because in
+# "a trash can", "a cup of coffee" or "an orange chair" they don't.
+LEXICON = {
+    **{w: ("biodegradable", "green") for w in (
+        "banana peel fruit vegetable food leaf flower rice bread egg eggshell bone husk stalk grass "
+        "compost mango onion potato tomato coconut corn twig branch manure dung sugarcane paddy wheat "
+        "apple lemon garlic chapati roti meal curry scrap").split()},
+    **{w: ("biodegradable", "green") for w in ("tea bag", "tea leaf", "coffee ground", "orange peel")},
+    **{w: ("recyclable", "blue") for w in "bottle cardboard carton newspaper magazine paper book jar aluminium aluminum tin".split()},
+    **{w: ("recyclable", "blue") for w in ("cardboard box", "tin can", "soda can", "beer can", "drink can", "aluminium can", "aluminum can")},
+    **{w: ("non-biodegradable", "blue") for w in "bag wrapper packet polythene styrofoam thermocol foam toy shoe rubber tyre tire sachet".split()},
+    **{w: ("medical", "yellow") for w in "syringe needle injection bandage gauze medicine pill blister vial".split()},
+    **{w: ("medical", "yellow") for w in ("face mask", "surgical mask", "latex glove", "surgical glove")},
+    **{w: ("medical", "red") for w in "blood catheter".split()},
+    **{w: ("medical", SANITARY_BIN) for w in "diaper tampon condom sanitary".split()},
+    **{w: ("electronic", "black") for w in (
+        "battery phone cellphone smartphone mobile laptop computer keyboard charger cable wire bulb circuit "
+        "headphone earphone television monitor printer calculator electronic screen").split()},
+}
+# Materials, colours, states and quantities: they describe the item without changing what it is.
+_MODIFIERS = frozenset((
+    "plastic glass metal steel iron wooden empty old used new broken cracked crushed torn dirty clean discarded dry wet "
+    "rotten fresh ripe half eaten small large big little white black red blue green yellow brown grey gray pink purple "
+    "pile heap bunch stack piece pair lot few several many two three four five close up view single whole").split())
+# When keywords disagree, hazardous streams win (a battery in a bag is still e-waste).
+_PRIORITY = {"medical": 0, "electronic": 1}
+# BLIP captions read "<item> on/in/next to <scene>"; keywords only count before these words,
+# so "a plastic straw on the grass" is not labelled as grass.
+_SCENE_WORDS = frozenset("on in at near next beside under inside by over behind against lying sitting laying".split())
+
+
+def lemma(word):
+    if word in _IRREGULAR:
+        return _IRREGULAR[word]
+    for suffix, replacement in (("ies", "y"), ("ches", "ch"), ("shes", "sh"), ("xes", "x"), ("s", "")):
+        if len(word) > 3 and word.endswith(suffix) and not word.endswith("ss"):
+            return word[: -len(suffix)] + replacement
+    return word
+
+
+def caption_lemmas(caption):
+    return [lemma(w) for w in normalize_query(caption).split() if w not in _STOPWORDS]
+
+
+def subject_lemmas(caption):
+    """Lemmas of the item part of the caption, before the scene it is found in."""
+    words = []
+    for word in normalize_query(caption).split():
+        if word in _SCENE_WORDS:
+            break
+        if word not in _STOPWORDS:
+            words.append(lemma(word))
+    return words
+
+
+def keyword_label(caption):
+    """((category, bin_color), confidence) from LEXICON, or None when it has no opinion.
+
+    Confidence is the share of the item's words, not counting _MODIFIERS, that the
+    lexicon accounts for: 1.0 for "a crushed plastic bottle", 1/3 for "a man wearing
+    a face mask". When words disagree, medical and then electronic win (a battery in
+    a bag is still e-waste); other disagreements have no opinion.
+    """
+    lemmas = [w for w in subject_lemmas(caption) if w not in _MODIFIERS]
+    votes, i = [], 0
+    while i < len(lemmas):
+        phrase = " ".join(lemmas[i:i + 2])
+        if phrase in LEXICON:
+            votes.append(LEXICON[phrase])
+            i += 2
+        else:
+            votes.append(LEXICON.get(lemmas[i]))
+            i += 1
+    hits = sorted({vote for vote in votes if vote is not None}, key=lambda hit: _PRIORITY.get(hit[0], 9))
+    if not hits or (len(hits) > 1 and _PRIORITY.get(hits[0][0], 9) == _PRIORITY.get(hits[1][0], 9)):
+        return None
+    return hits[0], sum(vote is not None for vote in votes) / len(votes)
+
+
+def features(lemmas):
+    return lemmas + [f"{left} {right}" for left, right in zip(lemmas, lemmas[1:])]
+
+
+def explain(caption, category, bin_color):
+    item = caption.strip().rstrip(".") or "This item"
+    return f"{item[0].upper()}{item[1:]} is {category} waste, so it goes in the {bin_color.split(' ')[0]} bin: {BIN_REASONS.get(bin_color, 'the bin for its waste type')}."
+
+
+def clean_labels(labels):
+    """The LLM's {category, bin_color, explanation}, normalised; None if it isn't one we can learn from."""
+    category = labels.get("category", "").strip().strip(".").lower()
+    bin_color = labels.get("bin_color", "").strip().strip(".").lower()
+    if category not in CATEGORIES:
+        return None
+    if bin_color.startswith("red (preferred)"):
+        bin_color = SANITARY_BIN
+    elif bin_color not in BIN_REASONS:
+        return None
+    return category, bin_color, labels.get("explanation", "").strip()
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over caption features, updated one example at a time."""
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha
+        self.label_counts = Counter()
+        self.feature_counts = {}  # label -> Counter
+        self.feature_totals = Counter()
+        self.vocabulary = set()
+
+    def learn(self, feats, label):
+        self.label_counts[label] += 1
+        self.feature_counts.setdefault(label, Counter()).update(feats)
+        self.feature_totals[label] += len(feats)
+        self.vocabulary.update(feats)
+
+    def predict(self, feats):
+        """(label, posterior) of the most likely label, or None when no feature has been seen."""
+        known = [f for f in feats if f in self.vocabulary]
+        if not known:
+            return None
+        total = sum(self.label_counts.values())
+        vocab = len(self.vocabulary)
+        scores = {}
+        for label, count in self.label_counts.items():
+            counts, denominator = self.feature_counts[label], self.feature_totals[label] + self.alpha * vocab
+            scores[label] = math.log(count / total) + sum(math.log((counts[f] + self.alpha) / denominator) for f in known)
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / norm
+
+    def to_dict(self):
+        return {"alpha": self.alpha, "labels": {"|".join(label): {"count": self.label_counts[label], "features": dict(self.feature_counts[label])}
+                                                for label in self.label_counts}}
+
+    @classmethod
+    def from_dict(cls, data):
+        model = cls(data.get("alpha", 0.5))
+        for key, entry in data.get("labels", {}).items():
+            label = tuple(key.split("|", 1))
+            model.label_counts[label] = entry["count"]
+            model.feature_counts[label] = Counter(entry["features"])
+            model.feature_totals[label] = sum(entry["features"].values())
+            model.vocabulary.update(entry["features"])
+        return model
+
+
+class LocalWasteClassifier:
+    """Answers common captions without the LLM and learns from the LLM's answers (see module docstring).
+
+    `min_confidence` is the confidence needed to answer, both for keyword hits (see
+    keyword_label) and for the naive Bayes posterior, and `min_examples` the Gemini
+    answers a label needs before the model may predict it. Memory holds at
+    most `capacity` captions, least recently used evicted first.
+    """
+
+    def __init__(self, min_confidence=0.9, min_examples=5, capacity=20000, use_keywords=True):
+        self.min_confidence = min_confidence
+        self.min_examples = min_examples
+        self.capacity = capacity
+        self.use_keywords = use_keywords
+        self.memory = OrderedDict()  # normalised caption -> (category, bin_color, explanation)
+        self.model = NaiveBayes()
+        self.counters = {"memory": 0, "keywords": 0, "model": 0, "llm": 0, "learned": 0, "rejected": 0}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def classify(self, caption):
+        """{category, bin_color, explanation} when confident, else None (and the call counts as an LLM one)."""
+        key = normalize_query(caption)
+        with self._lock:
+            labels, source = self._classify(key, caption)
+            self.counters[source] += 1
+        if labels is None:
+            return None
+        category, bin_color, explanation = labels
+        return {"category": category, "bin_color": bin_color, "explanation": explanation}
+
+    def _classify(self, key, caption):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key], "memory"
+        lemmas = caption_lemmas(caption)
+        if self.use_keywords:
+            hit = keyword_label(caption)
+            if hit is not None and hit[1] >= self.min_confidence:
+                category, bin_color = hit[0]
+                return (category, bin_color, explain(caption, category, bin_color)), "keywords"
+        prediction = self.model.predict(features(lemmas))
+        if prediction is not None:
+            (category, bin_color), posterior = prediction
+            if posterior >= self.min_confidence and self.model.label_counts[(category, bin_color)] >= self.min_examples:
+                return (category, bin_color, explain(caption, category, bin_color)), "model"
+        return None, "llm"
+
+    def learn(self, caption, labels):
+        """Records the LLM's labels for `caption`; answers outside the known categories and bins are ignored."""
+        cleaned = clean_labels(labels)
+        with self._lock:
+            if cleaned is None:
+                self.counters["rejected"] += 1
+                return
+            key = normalize_query(caption)
+            self.memory[key] = cleaned
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.capacity:
+                self.memory.popitem(last=False)
+            self.model.learn(features(caption_lemmas(caption)), cleaned[:2])
+            self.counters["learned"] += 1
+            self.dirty = True
+
+    def stats(self):
+        with self._lock:
+            local = self.counters["memory"] + self.counters["keywords"] + self.counters["model"]
+            total = local + self.counters["llm"]
+            return {**self.counters, "local_share": round(local / total, 4) if total else None, "captions": len(self.memory)}
+
+    def save(self, path):
+        """Atomic write, so workers saving at shutdown never leave a torn file."""
+        with self._lock:
+            data = {"memory": [[key, *labels] for key, labels in self.memory.items()], "model": self.model.to_dict()}
+            self.dirty = False
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, **settings):
+        """A classifier restored from `path`, or a fresh one if the file doesn't exist."""
+        classifier = cls(**settings)
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for key, category, bin_color, explanation in data.get("memory", []):
+                classifier.memory[key] = (category, bin_color, explanation)
+            classifier.model = NaiveBayes.from_dict(data.get("model", {}))
+        return classifier
+
+    @classmethod
+    def from_env(cls):
+        return cls.load(
+            os.getenv("WASTE_LOCAL_MODEL", "waste_local.json"),
+            min_confidence=float(os.getenv("WASTE_LOCAL_CONFIDENCE", "0.9")),
+            min_examples=int(os.getenv("WASTE_LOCAL_MIN_EXAMPLES", "5")),
+            capacity=int(os.getenv("WASTE_LOCAL_CAPACITY", "20000")),
+        )
+
+
+def read_records(paths):
+    """(caption, labels) from waste.py JSONL output ({"caption", "category", "bin", "explain"})."""
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "error" not in record and "caption" in record:
+                    yield record["caption"], {"category": record.get("category", ""), "bin_color": record.get("bin", ""), "explanation": record.get("explain", "")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("records", nargs="+", help="JSONL files written by waste.py")
+    parser.add_argument("--out", help="model file to write (WASTE_LOCAL_MODEL)")
+    parser.add_argument("--holdout", type=float, default=0.0, help="fraction of distinct captions held out for evaluation")
+    parser.add_argument("--min-confidence", type=float, default=0.9)
+    parser.add_argument("--min-examples", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    records = list(read_records(args.records))
+    captions = sorted({normalize_query(caption) for caption, _ in records})
+    held_out = set(random.Random(args.seed).sample(captions, int(len(captions) * args.holdout)))
+    classifier = LocalWasteClassifier(args.min_confidence, args.min_examples)
+    evaluation = [(caption, labels) for caption, labels in records if normalize_query(caption) in held_out]
+    for caption, labels in records:
+        if normalize_query(caption) not in held_out:
+            classifier.learn(caption, labels)
+    print(f"Learned {classifier.counters['learned']} answers for {len(classifier.memory)} captions ({classifier.counters['rejected']} rejected).")
+
+    if evaluation:
+        correct, started = 0, time.perf_counter()
+        for caption, labels in evaluation:
+            answer, expected = classifier.classify(caption), clean_labels(labels)
+            correct += answer is not None and expected is not None and (answer["category"], answer["bin_color"]) == expected[:2]
+        per_call_us = (time.perf_counter() - started) / len(evaluation) * 1e6
+        local = len(evaluation) - classifier.counters["llm"]
+        print(f"Held out {len(evaluation)} records of unseen captions: {local} answered locally "
+              f"({local / len(evaluation):.1%}), {correct} of them correct, {per_call_us:.0f} µs per caption.")
+    if args.out:
+        classifier.save(args.out)
+
+
+if __name__ == "__main__":
+    main()
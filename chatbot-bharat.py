@@ -1,34 +1,58 @@
 import os
-from langchain_core.prompts import ChatPromptTemplate
+import sys
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from semantic_cache import SemanticCache
+from llm_gateway import LLMGateway
+from gateway_chat import GatewayChatModel
+from conversation import SUMMARY_PROMPT, ConversationMemory
 
 
 os.environ["GOOGLE_API_KEY"] = "xxxxx"
 
 
+SYSTEM_PROMPT = "You are EcoBot, a helpful assistant for Indian environmental and constitutional law queries."
+
 eco_prompt = ChatPromptTemplate.from_messages([
-    ("system", "You are EcoBot, a helpful assistant for Indian environmental and constitutional law queries."),
+    ("system", SYSTEM_PROMPT),
+    MessagesPlaceholder("history", optional=True),
     ("human", "{input}")
 ])
 
 
-llm = ChatGoogleGenerativeAI(
-    model="models/gemini-1.5-flash",
-    google_api_key="xxxxx"
+llm = GatewayChatModel(
+    gateway=LLMGateway.from_env("xxxxx"),
+    model="models/gemini-1.5-flash"
 )
 
 
 chain = eco_prompt | llm | StrOutputParser()
+cache = SemanticCache()
+# Follow-ups ("Is it related to...?") are answered with the earlier turns, within a token budget.
+memory = ConversationMemory(SYSTEM_PROMPT, summarizer=ChatPromptTemplate.from_template(SUMMARY_PROMPT) | llm | StrOutputParser())
 
 
-def get_answer(query):
+def get_answer(query, bypass_cache=False, session_id="default"):
+    history = memory.history(session_id, query)
+    cached = None if history else cache.get(query, bypass=bypass_cache)
+    if cached is not None:
+        memory.record(session_id, query, cached)
+        return cached
     try:
-        result = chain.invoke({"input": query}) 
-        return result
+        result = chain.invoke({"input": query, "history": history})
     except Exception as e:
         print("❌ Error:", e)
         return "Sorry, I couldn’t find a valid answer."
+    if not history:
+        cache.put(query, result)
+    if memory.record(session_id, query, result):
+        try:
+            memory.compact(session_id)
+        except Exception as e:
+            print("⚠️ Could not summarize the conversation:", e)
+    return result
 
 print(get_answer("What is Article 48A of the Indian Constitution?"))
 print(get_answer("Is it related to forest protection?"))
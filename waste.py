@@ -1,32 +1,53 @@
 import os
+import sys
+import glob
+import asyncio
+import argparse
+import threading
 from PIL import Image
-import torch
 from dotenv import load_dotenv
-from transformers import BlipProcessor, BlipForConditionalGeneration
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema.runnable import RunnableMap, RunnablePassthrough
 from getpass import getpass
 
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from waste_llm import WasteLabeler
+from waste_local import LocalWasteClassifier
+from llm_gateway import LLMGateway
+from gateway_chat import GatewayChatModel
+from inference import make_caption_engine
+
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 
 
-llm = ChatGoogleGenerativeAI(model="models/gemini-1.5-flash", google_api_key=GOOGLE_API_KEY, temperature=0)
+# Pooled, rate-limited and retried; the batch CLI's concurrent labels share its limits.
+llm = GatewayChatModel(gateway=LLMGateway.from_env(GOOGLE_API_KEY), model="models/gemini-1.5-flash", temperature=0)
+
+# BLIP is loaded once per process on first use (CAPTION_ENGINE picks torch/int8/onnx).
+_caption_engine = None
+_caption_engine_lock = threading.Lock()
+
+def get_caption_engine():
+    global _caption_engine
+    with _caption_engine_lock:
+        if _caption_engine is None:
+            _caption_engine = make_caption_engine().load()
+    return _caption_engine
 
 def generate_caption(image_path):
-    processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
     image = Image.open(image_path).convert("RGB")
-    inputs = processor(image, return_tensors="pt")
-    out = model.generate(**inputs)
-    caption = processor.decode(out[0], skip_special_tokens=True)
+    caption = get_caption_engine().caption_batch([image])[0]
     return caption
 
+def generate_captions(images):
+    """Captions a list of PIL images as one batched tensor."""
+    return get_caption_engine().caption_batch(images)
+
 
 prompt_classify = PromptTemplate.from_template("""
 You are an intelligent waste classification assistant.
@@ -114,6 +135,13 @@ chain_explain = (
     | llm
     | StrOutputParser()
 )
+
+# Same three prompts as above, run concurrently or as one structured call (WASTE_LLM_MODE).
+# Captions seen before or matching the keyword lexicon are labelled locally without Gemini.
+WASTE_LOCAL_MODEL = os.getenv("WASTE_LOCAL_MODEL", "waste_local.json")
+waste_local = LocalWasteClassifier.from_env()
+waste_labeler = WasteLabeler(llm, prompt_classify, prompt_bin, prompt_explain, local=waste_local)
+
 def classify_image(image_path):
 
     caption = generate_caption(image_path)
@@ -140,7 +168,7 @@ def classify_bin(image_path):
 
 
 
-    result = chain_classify.invoke(caption)
+    result = chain_bin.invoke(caption)
 
     return(result)
 
@@ -150,7 +178,7 @@ def classify_explain(image_path):
 
 
 
-    result = chain_classify.invoke(caption)
+    result = chain_explain.invoke(caption)
 
     return(result)
 
@@ -164,23 +192,115 @@ def answer_dict(image_path):
     caption = generate_caption(image_path)
 
 
-    category = chain_classify.invoke(caption).strip()
-    bin_color = chain_bin.invoke(caption).strip()
-    explanation = chain_explain.invoke(caption).strip()
+    labels = waste_labeler.label(caption)
 
     return {
         "caption": caption,
-        "category": category,
-        "bin": bin_color,
-        "explain": explanation
+        "category": labels["category"],
+        "bin": labels["bin_color"],
+        "explain": labels["explanation"]
     }
 
 def answer_json(image_path):
     result = answer_dict(image_path)
     return json.dumps(result, indent=4)
 
-#######
-####BELOW ARE EXAMPLES#####3
-img="dropped-iphone-pretty-hard-v0-lhdszpzslq2d1.jpeg.webp"
-print(answer_dict(img))
-#########
\ No newline at end of file
+
+# ==============================================================================
+# --- BATCH MODE (directory or glob -> JSONL) ---
+# ==============================================================================
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+def iter_image_paths(target):
+    if os.path.isdir(target):
+        paths = glob.glob(os.path.join(target, "**", "*"), recursive=True)
+    else:
+        paths = glob.glob(target, recursive=True)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+def load_checkpoint(out_path):
+    """The output JSONL is the checkpoint: images with a successful record are skipped on resume."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            if "error" not in record:
+                done.add(record["image"])
+    return done
+
+def caption_paths(paths):
+    """Returns {path: caption}; unreadable images map to an Exception instead."""
+    results, images, readable = {}, [], []
+    for path in paths:
+        try:
+            images.append(Image.open(path).convert("RGB"))
+            readable.append(path)
+        except Exception as e:
+            results[path] = e
+    if images:
+        results.update(zip(readable, generate_captions(images)))
+    return results
+
+async def label_and_write(path, caption, semaphore, out):
+    if isinstance(caption, Exception):
+        record = {"image": path, "error": f"unreadable image: {caption}"}
+    else:
+        async with semaphore:
+            try:
+                labels = await waste_labeler.alabel(caption)
+                record = {"image": path, "caption": caption, "category": labels["category"], "bin": labels["bin_color"], "explain": labels["explanation"]}
+            except Exception as e:
+                record = {"image": path, "caption": caption, "error": str(e)}
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+
+async def classify_directory(target, out_path, batch_size=16, concurrency=8):
+    """Captions images in batches and classifies them with at most `concurrency` LLM calls in flight.
+
+    Captioning of the next batch overlaps with classification of the previous one.
+    Returns the number of images processed in this run.
+    """
+    done = load_checkpoint(out_path)
+    pending = [p for p in iter_image_paths(target) if p not in done]
+    print(f"{len(pending)} images to process ({len(done)} already done).")
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    with open(out_path, "a") as out:
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            captions = await asyncio.to_thread(caption_paths, batch)
+            for path in batch:
+                task = asyncio.create_task(label_and_write(path, captions[path], semaphore, out))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # Stay at most about one batch ahead of the LLM so memory stays flat.
+            while len(tasks) > max(concurrency, batch_size):
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if tasks:
+            await asyncio.wait(tasks)
+    return len(pending)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify one waste image, or a directory/glob of them into JSONL.")
+    parser.add_argument("target", help="image file, directory or glob")
+    parser.add_argument("--out", help="JSONL output (and resume checkpoint) for batch mode")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    if os.path.isfile(args.target) and not args.out:
+        print(answer_json(args.target))
+    else:
+        processed = asyncio.run(classify_directory(args.target, args.out or "waste_audit.jsonl", args.batch_size, args.concurrency))
+        print(f"Processed {processed} images.")
+        stats = waste_local.stats()
+        if stats["local_share"] is not None:
+            print(f"Labelled locally: {stats['local_share']:.0%} (memory {stats['memory']}, keywords {stats['keywords']}, model {stats['model']}; LLM {stats['llm']}).")
+    if waste_local.dirty:
+        waste_local.save(WASTE_LOCAL_MODEL)